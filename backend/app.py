@@ -1,31 +1,88 @@
 import os
 import logging
 import asyncio
+import json
+from decimal import Decimal
+import orjson
 from flask import Flask, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from pydantic import BaseModel
 from config.settings import get_config
 from routes.api import api_bp
 from routes.auth_routes import auth_bp
 from db.database import db_service
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def configure_logging(config, testing=False):
+    """Log to the console and, outside of tests, to LOG_FILE when it is set."""
+    handlers = [logging.StreamHandler()]
+    if config.LOG_FILE and not testing:
+        handlers.append(logging.FileHandler(config.LOG_FILE))
+    logging.basicConfig(
+        level=config.LOG_LEVEL,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+class ORJSONProvider(JSONProvider):
+    """
+    JSON provider backed by orjson that also serializes Prisma models.
+    
+    Keys are sorted as with Flask's default provider. Non-ASCII text such as
+    Arabic is sent as UTF-8 rather than \\u escapes, which orjson cannot produce;
+    dumps() falls back to the json module for options orjson has no equivalent for.
+    """
+    
+    option = orjson.OPT_NON_STR_KEYS
+    sort_keys = True
+    
+    @staticmethod
+    def default(obj):
+        """Convert types orjson does not handle natively."""
+        if isinstance(obj, BaseModel):
+            return obj.model_dump() if hasattr(obj, 'model_dump') else obj.dict()
+        if isinstance(obj, Decimal):
+            return str(obj)
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    
+    def _option(self, sort_keys):
+        return self.option | orjson.OPT_SORT_KEYS if sort_keys else self.option
+    
+    def dumps(self, obj, **kwargs):
+        sort_keys = kwargs.pop('sort_keys', self.sort_keys)
+        indent = kwargs.pop('indent', None)
+        ensure_ascii = kwargs.pop('ensure_ascii', False)
+        if kwargs or ensure_ascii or indent not in (None, 2):
+            kwargs.setdefault('default', self.default)
+            return json.dumps(obj, sort_keys=sort_keys, indent=indent, ensure_ascii=ensure_ascii, **kwargs)
+        
+        option = self._option(sort_keys)
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of decoding to str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self._option(self.sort_keys)),
+            mimetype="application/json"
+        )
+
 def create_app(config_name=None):
     """Create and configure the Flask application."""
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
     
     # Load configuration
     config = get_config()
     app.config.from_object(config)
+    configure_logging(config, testing=config_name == 'testing' or app.config.get('TESTING', False))
     
     # Enable CORS with authentication support
     CORS(app, 
@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from typing import Optional
 from dotenv import load_dotenv
 
@@ -17,6 +18,10 @@ class Config:
     if not DATABASE_URL:
         raise ValueError("DATABASE_URL environment variable is required")
     
+    # Prisma connection pool, added to DATABASE_URL unless it already sets them
+    DB_CONNECTION_LIMIT = int(os.getenv('DB_CONNECTION_LIMIT', str((os.cpu_count() or 1) * 2 + 1)))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', '10'))
+    
     # JWT Authentication Configuration
     JWT_SECRET = os.getenv('JWT_SECRET', 'dev-jwt-secret-change-in-production')
     JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
@@ -29,9 +34,25 @@ class Config:
     
     # API Configuration
     GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
-    MAX_TOKENS = int(os.getenv('MAX_TOKENS', '1000'))
     TEMPERATURE = float(os.getenv('TEMPERATURE', '0.7'))
     
+    GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '8'))
+    GEMINI_TRANSPORT = os.getenv('GEMINI_TRANSPORT', 'grpc')
+    GEMINI_RPM = float(os.getenv('GEMINI_RPM', '0'))
+    GEMINI_MAX_INPUT_TOKENS = int(os.getenv('GEMINI_MAX_INPUT_TOKENS', '32000'))
+    GEMINI_MAX_INPUT_CHARS = int(os.getenv('GEMINI_MAX_INPUT_CHARS', '500000'))
+    GEMINI_BREAKER_THRESHOLD = int(os.getenv('GEMINI_BREAKER_THRESHOLD', '3'))
+    GEMINI_BREAKER_COOLDOWN_SECONDS = float(os.getenv('GEMINI_BREAKER_COOLDOWN_SECONDS', '30'))
+    
+    # Gemini Response Cache Configuration
+    GEMINI_CACHE_SIZE = int(os.getenv('GEMINI_CACHE_SIZE', '512'))
+    GEMINI_CACHE_TTL_SECONDS = int(os.getenv('GEMINI_CACHE_TTL_SECONDS', '3600'))
+    GEMINI_DISK_CACHE_PATH = os.getenv('GEMINI_DISK_CACHE_PATH', '')
+    GEMINI_DISK_CACHE_TTL_SECONDS = int(os.getenv('GEMINI_DISK_CACHE_TTL_SECONDS', '604800'))
+    GEMINI_SEMANTIC_CACHE_THRESHOLD = float(os.getenv('GEMINI_SEMANTIC_CACHE_THRESHOLD', '0'))
+    GEMINI_SEMANTIC_CACHE_SIZE = int(os.getenv('GEMINI_SEMANTIC_CACHE_SIZE', '256'))
+    GEMINI_EMBEDDING_MODEL = os.getenv('GEMINI_EMBEDDING_MODEL', 'models/text-embedding-004')
+    
     # CORS Configuration
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', '*').split(',')
     
@@ -79,7 +100,11 @@ config = {
     'default': DevelopmentConfig
 }
 
+@lru_cache(maxsize=None)
+def _load_config(env: str) -> Config:
+    """Build the configuration for an environment once."""
+    return config.get(env, config['default'])()
+
 def get_config() -> Config:
     """Get configuration based on environment."""
-    env = os.getenv('FLASK_ENV', 'development')
-    return config.get(env, config['default'])()
+    return _load_config(os.getenv('FLASK_ENV', 'development'))
@@ -1,14 +1,29 @@
 import asyncio
 import logging
-from typing import Optional, Dict, Any, List
-from contextlib import asynccontextmanager
+from functools import wraps
+from typing import Optional, Dict, List, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 from prisma import Prisma
+from prisma.actions import SessionActions
+from prisma.models import Session, User
+from prisma.partials import SessionListItem
 from config.settings import get_config
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def logged(op: str):
+    """Log a failed database operation with its traceback and re-raise."""
+    def decorator(f):
+        @wraps(f)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await f(*args, **kwargs)
+            except Exception:
+                logger.exception("Database operation %s failed", op)
+                raise
+        return wrapper
+    return decorator
+
 class DatabaseService:
     """Database service for managing Prisma client and database operations."""
     
@@ -16,69 +31,64 @@ class DatabaseService:
         self.client: Optional[Prisma] = None
         self.config = get_config()
     
+    @logged('connect')
     async def connect(self) -> None:
         """Connect to the database."""
-        try:
-            if not self.client:
-                self.client = Prisma()
-            
-            if not self.client.is_connected():
-                await self.client.connect()
-                logger.info("Successfully connected to database")
-        except Exception as e:
-            logger.error(f"Failed to connect to database: {e}")
-            raise
+        if not self.client:
+            self.client = Prisma(datasource={'url': self._datasource_url()})
+        
+        if not self.client.is_connected():
+            await self.client.connect()
+            logger.info("Successfully connected to database")
+    
+    def _datasource_url(self) -> str:
+        """Return DATABASE_URL with explicit connection pool settings."""
+        parts = urlsplit(self.config.DATABASE_URL)
+        query = dict(parse_qsl(parts.query))
+        query.setdefault('connection_limit', str(self.config.DB_CONNECTION_LIMIT))
+        query.setdefault('pool_timeout', str(self.config.DB_POOL_TIMEOUT))
+        return urlunsplit(parts._replace(query=urlencode(query)))
     
+    @logged('disconnect')
     async def disconnect(self) -> None:
         """Disconnect from the database."""
-        try:
-            if self.client and self.client.is_connected():
-                await self.client.disconnect()
-                logger.info("Successfully disconnected from database")
-        except Exception as e:
-            logger.error(f"Failed to disconnect from database: {e}")
-            raise
+        if self.client and self.client.is_connected():
+            await self.client.disconnect()
+            logger.info("Successfully disconnected from database")
     
-    @asynccontextmanager
-    async def get_client(self):
-        """Get database client with automatic connection management."""
-        try:
+    async def _get_client(self) -> Prisma:
+        """Return the connected client, connecting on first use."""
+        if self.client is None or not self.client.is_connected():
             await self.connect()
-            yield self.client
-        finally:
-            # Keep connection alive for performance, only disconnect on app shutdown
-            pass
+        return self.client
     
-    async def create_user(self, name: str, email: str, language_pref: str = "english") -> Dict[str, Any]:
+    @logged('create_user')
+    async def create_user(self, name: str, email: str, language_pref: str = "english") -> User:
         """Create a new user."""
-        async with self.get_client() as client:
-            try:
-                user = await client.user.create(
-                    data={
-                        'name': name,
-                        'email': email,
-                        'languagePref': language_pref
-                    }
-                )
-                logger.info(f"Created user: {user.email}")
-                return user.dict()
-            except Exception as e:
-                logger.error(f"Failed to create user: {e}")
-                raise
+        client = await self._get_client()
+        user = await client.user.create(
+            data={
+                'name': name,
+                'email': email,
+                'languagePref': language_pref
+            }
+        )
+        logger.info("Created user: %s", user.email)
+        return user
     
-    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
-        """Get user by email."""
-        async with self.get_client() as client:
-            try:
-                user = await client.user.find_unique(
-                    where={'email': email},
-                    include={'sessions': True}
-                )
-                return user.dict() if user else None
-            except Exception as e:
-                logger.error(f"Failed to get user by email: {e}")
-                raise
+    @logged('get_user_by_email')
+    async def get_user_by_email(self, email: str, with_sessions: bool = False) -> Optional[User]:
+        """Get user by email, optionally with their 20 most recent sessions."""
+        client = await self._get_client()
+        include = None
+        if with_sessions:
+            include = {'sessions': {'take': 20, 'order_by': {'createdAt': 'desc'}}}
+        return await client.user.find_unique(
+            where={'email': email},
+            include=include
+        )
     
+    @logged('create_session')
     async def create_session(
         self, 
         user_id: int, 
@@ -86,67 +96,67 @@ class DatabaseService:
         output_summary: Optional[str] = None,
         output_explanation: Optional[str] = None,
         output_exercises: Optional[List[Dict[str, str]]] = None
-    ) -> Dict[str, Any]:
+    ) -> Session:
         """Create a new session record."""
-        async with self.get_client() as client:
-            try:
-                session = await client.session.create(
-                    data={
-                        'userId': user_id,
-                        'inputText': input_text,
-                        'outputSummary': output_summary,
-                        'outputExplanation': output_explanation,
-                        'outputExercises': output_exercises
-                    }
-                )
-                logger.info(f"Created session: {session.id}")
-                return session.dict()
-            except Exception as e:
-                logger.error(f"Failed to create session: {e}")
-                raise
+        client = await self._get_client()
+        session = await client.session.create(
+            data={
+                'userId': user_id,
+                'inputText': input_text,
+                'outputSummary': output_summary,
+                'outputExplanation': output_explanation,
+                'outputExercises': output_exercises
+            }
+        )
+        logger.info("Created session: %s", session.id)
+        return session
     
+    @logged('update_session')
     async def update_session(
         self, 
         session_id: int, 
         output_summary: Optional[str] = None,
         output_explanation: Optional[str] = None,
         output_exercises: Optional[List[Dict[str, str]]] = None
-    ) -> Dict[str, Any]:
+    ) -> Optional[Session]:
         """Update session with outputs."""
-        async with self.get_client() as client:
-            try:
-                update_data = {}
-                if output_summary is not None:
-                    update_data['outputSummary'] = output_summary
-                if output_explanation is not None:
-                    update_data['outputExplanation'] = output_explanation
-                if output_exercises is not None:
-                    update_data['outputExercises'] = output_exercises
-                
-                session = await client.session.update(
-                    where={'id': session_id},
-                    data=update_data
-                )
-                logger.info(f"Updated session: {session_id}")
-                return session.dict()
-            except Exception as e:
-                logger.error(f"Failed to update session: {e}")
-                raise
+        client = await self._get_client()
+        update_data = {
+            field: value
+            for field, value in (
+                ('outputSummary', output_summary),
+                ('outputExplanation', output_explanation),
+                ('outputExercises', output_exercises)
+            )
+            if value is not None
+        }
+        if not update_data:
+            # Nothing to write, so skip the no-op UPDATE
+            return await client.session.find_unique(where={'id': session_id})
+        
+        session = await client.session.update(
+            where={'id': session_id},
+            data=update_data
+        )
+        logger.info("Updated session: %s", session_id)
+        return session
     
-    async def get_user_sessions(self, user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get user's recent sessions."""
-        async with self.get_client() as client:
-            try:
-                sessions = await client.session.find_many(
-                    where={'userId': user_id},
-                    order={'createdAt': 'desc'},
-                    take=limit,
-                    include={'user': True}
-                )
-                return [session.dict() for session in sessions]
-            except Exception as e:
-                logger.error(f"Failed to get user sessions: {e}")
-                raise
+    @logged('get_user_sessions')
+    async def get_user_sessions(
+        self,
+        user_id: int,
+        limit: int = 10,
+        list_view: bool = False
+    ) -> List[Union[Session, SessionListItem]]:
+        """Get user's recent sessions; list_view selects only the columns a list needs."""
+        client = await self._get_client()
+        actions = SessionActions(client, SessionListItem) if list_view else client.session
+        sessions = await actions.find_many(
+            where={'userId': user_id},
+            order={'createdAt': 'desc'},
+            take=limit
+        )
+        return sessions
 
 # Global database service instance
 db_service = DatabaseService()
@@ -0,0 +1,8 @@
+"""Partial model definitions, generated into prisma.partials by `prisma generate`."""
+from prisma.models import Session
+
+# Columns needed to list sessions, without the multi-KB input text and outputs
+Session.create_partial(
+    'SessionListItem',
+    include={'id', 'userId', 'sessionType', 'outputSummary', 'collectionId', 'createdAt'}
+)
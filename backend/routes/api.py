@@ -1,15 +1,14 @@
 import asyncio
 import logging
 from functools import wraps
-from flask import Blueprint, request, jsonify, current_app
-from services.gemini_service import gemini_service
+import orjson
+from flask import Blueprint, Response, request, jsonify, current_app
+from services.gemini_service import get_gemini_service
 from services.session_service import session_service
 from services.collection_service import collection_service
 from middleware.auth_middleware import auth_required_async, get_current_user, optional_auth
 from db.database import db_service
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Create API blueprint
@@ -34,6 +33,72 @@ def async_route(f):
             }), 500
     return wrapper
 
+def _text_error(action, error):
+    """Marker line that ends a text/plain stream which failed part way."""
+    return f"\n\n[error] Failed to generate {action}: {error}\n"
+
+def _ndjson_line(item):
+    return orjson.dumps(item) + b"\n"
+
+def _ndjson_error(action, error):
+    """Final ndjson record of a stream which failed part way."""
+    return _ndjson_line({'error': f'Failed to generate {action}', 'message': str(error)})
+
+def stream_async(agen, action, mimetype='text/plain', encode=str, encode_error=_text_error):
+    """
+    Send the items of an async generator as a streamed response.
+    
+    The first item is produced before the response starts, so an early
+    failure still gets a JSON error body and a 4xx/5xx status. A failure
+    after that ends the body with encode_error's record instead.
+    """
+    loop = asyncio.new_event_loop()
+    
+    def close():
+        if not loop.is_closed():
+            loop.run_until_complete(agen.aclose())
+            loop.close()
+    
+    try:
+        first = [loop.run_until_complete(agen.__anext__())]
+    except StopAsyncIteration:
+        first = []
+    except ValueError as e:
+        close()
+        logger.warning(f"Validation error while streaming {action}: {e}")
+        return jsonify({
+            'error': 'Invalid input',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        close()
+        logger.error(f"Error while streaming {action}: {e}")
+        return jsonify({
+            'error': f'Failed to generate {action}',
+            'message': str(e)
+        }), 500
+    
+    def generate():
+        try:
+            for item in first:
+                yield encode(item)
+            while True:
+                try:
+                    item = loop.run_until_complete(agen.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield encode(item)
+        except Exception as e:
+            logger.error(f"Error while streaming {action}: {e}")
+            yield encode_error(action, e)
+        finally:
+            close()
+    
+    response = Response(generate(), mimetype=mimetype)
+    # Also runs if the client goes away before the body is iterated
+    response.call_on_close(close)
+    return response
+
 def validate_json_input(required_fields):
     """Decorator to validate JSON input."""
     def decorator(f):
@@ -118,7 +183,7 @@ async def summarize_content():
         logger.info(f"Summarizing content for user {user_id} in {language_preference}: {len(input_text)} characters")
         
         # Generate summary using Gemini AI
-        summary = await gemini_service.summarize_content(input_text, language_preference)
+        summary = await get_gemini_service().summarize_content(input_text, language_preference)
         
         # Store in database if user is authenticated
         session_id = None
@@ -161,6 +226,34 @@ async def summarize_content():
             'message': str(e)
         }), 500
 
+@api_bp.route('/summarize/stream', methods=['POST', 'OPTIONS'])
+@validate_json_input(['text'])
+def summarize_content_stream():
+    """
+    Stream a summary of course content as Gemini generates it.
+    Sessions are not stored for streamed summaries.
+    
+    Expected input:
+    {
+        "text": "copied course content or headings",
+        "language_preference": "arabic" | "english" | "both"  // optional, defaults to "english"
+    }
+    
+    Returns:
+        text/plain body with the summary, sent in pieces as they are generated;
+        a failure part way ends it with an "[error] ..." line
+    """
+    data = request.get_json()
+    input_text = data['text'].strip()
+    language_preference = data.get('language_preference', 'english').lower()
+    
+    logger.info(f"Streaming summary in {language_preference}: {len(input_text)} characters")
+    
+    return stream_async(
+        get_gemini_service().summarize_content_stream(input_text, language_preference),
+        'summary'
+    )
+
 @api_bp.route('/explain', methods=['POST', 'OPTIONS'])
 @validate_json_input(['text'])
 @optional_auth
@@ -194,7 +287,7 @@ async def explain_content():
         logger.info(f"Explaining content for user {user_id} in {language_preference}: {len(input_text)} characters")
         
         # Generate explanation using Gemini AI 
-        explanation = await gemini_service.explain_content(input_text, language_preference)
+        explanation = await get_gemini_service().explain_content(input_text, language_preference)
         
         response = {
             'explanation': explanation,
@@ -235,6 +328,34 @@ async def explain_content():
             'message': str(e)
         }), 500
 
+@api_bp.route('/explain/stream', methods=['POST', 'OPTIONS'])
+@validate_json_input(['text'])
+def explain_content_stream():
+    """
+    Stream an explanation of course content as Gemini generates it.
+    Sessions are not stored for streamed explanations.
+    
+    Expected input:
+    {
+        "text": "copied course content or headings",
+        "language_preference": "arabic" | "english" | "both"  // optional, defaults to "english"
+    }
+    
+    Returns:
+        text/plain body with the explanation, sent in pieces as they are generated;
+        a failure part way ends it with an "[error] ..." line
+    """
+    data = request.get_json()
+    input_text = data['text'].strip()
+    language_preference = data.get('language_preference', 'english').lower()
+    
+    logger.info(f"Streaming explanation in {language_preference}: {len(input_text)} characters")
+    
+    return stream_async(
+        get_gemini_service().explain_content_stream(input_text, language_preference),
+        'explanation'
+    )
+
 @api_bp.route('/generate_exercises', methods=['POST', 'OPTIONS'])
 @validate_json_input(['text'])
 @optional_auth
@@ -268,7 +389,7 @@ async def generate_exercises():
         logger.info(f"Generating exercises for user {user_id} in {language_preference}: {len(input_text)} characters")
         
         # Generate exercises using Gemini AI
-        exercises = await gemini_service.generate_exercises(input_text, language_preference)
+        exercises = await get_gemini_service().generate_exercises(input_text, language_preference)
         
         response = {
             'exercises': exercises,
@@ -309,6 +430,37 @@ async def generate_exercises():
             'message': str(e)
         }), 500
 
+@api_bp.route('/generate_exercises/stream', methods=['POST', 'OPTIONS'])
+@validate_json_input(['text'])
+def generate_exercises_stream():
+    """
+    Stream exercises one by one as Gemini finishes each of them.
+    Sessions are not stored for streamed exercises.
+    
+    Expected input:
+    {
+        "text": "copied course content or headings",
+        "language_preference": "arabic" | "english" | "both"  // optional, defaults to "english"
+    }
+    
+    Returns:
+        application/x-ndjson body with one exercise object per line;
+        a failure part way ends it with an {"error": ..., "message": ...} line
+    """
+    data = request.get_json()
+    input_text = data['text'].strip()
+    language_preference = data.get('language_preference', 'english').lower()
+    
+    logger.info(f"Streaming exercises in {language_preference}: {len(input_text)} characters")
+    
+    return stream_async(
+        get_gemini_service().generate_exercises_stream(input_text, language_preference),
+        'exercises',
+        mimetype='application/x-ndjson',
+        encode=_ndjson_line,
+        encode_error=_ndjson_error
+    )
+
 # Protected routes for authenticated users
 
 @api_bp.route('/sessions', methods=['GET'])
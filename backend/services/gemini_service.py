@@ -1,122 +1,287 @@
 import asyncio
+import concurrent.futures
+import functools
+import hashlib
 import logging
+import math
+import operator
+import random
+import re
+import sqlite3
+import threading
 import time
-from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Final, Iterator, List, NamedTuple, Optional, Tuple
 import google.generativeai as genai
+import orjson
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from google.api_core.exceptions import DeadlineExceeded, ResourceExhausted, ServiceUnavailable
 from config.settings import get_config
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class GeminiService:
-    """Service for interacting with Google's Gemini API."""
-    
-    def __init__(self):
-        self.config = get_config()
-        self._configure_api()
-        self.model = None
-        self._initialize_model()
-        self.max_retries = 3
-        self.base_delay = 1  # seconds
-    
-    def _configure_api(self) -> None:
-        """Configure the Gemini API with API key."""
-        try:
-            genai.configure(api_key=self.config.GEMINI_API_KEY)
-            logger.info("Gemini API configured successfully")
-        except Exception as e:
-            logger.error(f"Failed to configure Gemini API: {e}")
-            raise
-    
-    def _initialize_model(self) -> None:
-        """Initialize the Gemini model with safety settings."""
-        try:
-            # Safety settings to handle educational content appropriately
-            safety_settings = {
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            }
-            
-            # Generation configuration with timeout settings
-            generation_config = genai.types.GenerationConfig(
-                temperature=self.config.TEMPERATURE,
-                max_output_tokens=self.config.MAX_TOKENS,
-                top_p=0.8,
-                top_k=40
-            )
-            
-            self.model = genai.GenerativeModel(
-                model_name=self.config.GEMINI_MODEL,
-                safety_settings=safety_settings,
-                generation_config=generation_config
-            )
-            logger.info(f"Gemini model '{self.config.GEMINI_MODEL}' initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize Gemini model: {e}")
-            raise
-    
-    async def test_connection(self) -> bool:
-        """Test the connection to Gemini API."""
-        try:
-            test_prompt = "Say hello"
-            response = await self._generate_content_with_retry(test_prompt)
-            logger.info("Gemini API connection test successful")
-            return True
-        except Exception as e:
-            logger.error(f"Gemini API connection test failed: {e}")
-            return False
-    
-    async def _generate_content_with_retry(self, prompt: str) -> str:
-        """Generate content with retry logic and improved error handling."""
-        max_retries = 3
-        base_delay = 3
-        max_timeout = 90.0  # Reduced timeout to 90 seconds
-        
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"Attempting to generate content with Gemini (attempt {attempt + 1}/{max_retries})...")
-                
-                # Use asyncio.wait_for to add timeout
-                response = await asyncio.wait_for(
-                    self._generate_content_internal(prompt),
-                    timeout=max_timeout
-                )
-                
-                return response
-            except asyncio.TimeoutError:
-                error_msg = f"Request timed out after {max_timeout} seconds (attempt {attempt + 1})"
-                logger.error(error_msg)
-                if attempt == max_retries - 1:
-                    raise Exception("The AI service is currently busy. Please try again in a moment with shorter content.")
-                await asyncio.sleep(base_delay * (2 ** attempt))  # Exponential backoff
-            except Exception as e:
-                error_str = str(e).lower()
-                if "503" in error_str or "overloaded" in error_str:
-                    logger.error(f"Gemini API overloaded (attempt {attempt + 1}): {e}")
-                    if attempt == max_retries - 1:
-                        return self._get_fallback_response(prompt)
-                    await asyncio.sleep(base_delay * (2 ** attempt) + 5)  # Extra delay for overload
-                elif "timeout" in error_str:
-                    logger.error(f"Request timeout (attempt {attempt + 1}): {e}")
-                    if attempt == max_retries - 1:
-                        raise Exception("Request timed out. Please try again with shorter content.")
-                    await asyncio.sleep(base_delay * (2 ** attempt))
-                else:
-                    logger.error(f"Error generating content (attempt {attempt + 1}): {e}")
-                    if attempt == max_retries - 1:
-                        return self._get_fallback_response(prompt)
-                    await asyncio.sleep(base_delay * (2 ** attempt))
+# Pulls the English and Arabic halves out of a bilingual explanation
+_BILINGUAL_RE = re.compile(r"<<<EN>>>(.*?)<<<END_EN>>>.*?<<<AR>>>(.*?)<<<END_AR>>>", re.DOTALL)
 
-    def _get_fallback_response(self, prompt: str) -> str:
-        """Generate a fallback response when API is unavailable."""
-        logger.warning("Using fallback response due to API issues")
-        
-        if "summarize" in prompt.lower():
-            return """# Summary
+# Start of an exercise in either '=== EXERCISE N ===' or 'Exercise N:' form
+_EXERCISE_HEADER_RE = re.compile(
+    r"^[ \t]*(?:===[ \t]*)?Exercise[ \t]*\d+[ \t]*(?:===|:)", re.IGNORECASE | re.MULTILINE
+)
+# Body of one exercise block: an optional Type: line, then the question and its answer
+_EXERCISE_BODY_RE = re.compile(
+    r"\s*(?:Type:[^\n]*\n)?\s*Question:\s*(?P<question>.*?)\s*Answer:\s*(?P<answer>.*)",
+    re.DOTALL | re.IGNORECASE,
+)
+_LINE_BREAKS_RE = re.compile(r"[ \t]*\n\s*")
+_WHITESPACE_RE = re.compile(r"\s")
+_PARAGRAPH_BREAK_RE = re.compile(r"\n{2,}")
+_HORIZONTAL_SPACE_RE = re.compile(r"[ \t]+")
+_TRAILING_SPACE_RE = re.compile(r"[ \t]+$", re.MULTILINE)
+_LINE_END_RE = re.compile(r"\r\n?|\v")
+# Zero-width space, word joiner, byte order mark and soft hyphen; the Arabic
+# shaping controls (ZWJ/ZWNJ) are kept
+_INVISIBLE_CHARS_RE = re.compile("[\u200b\u2060\ufeff\u00ad]")
+
+# Texts longer than this have runs of spaces collapsed before prompting
+COMPACT_TEXT_CHARS = 50_000
+# Tokens reserved for the template around the course text in each prompt
+PROMPT_OVERHEAD_TOKENS = 1_000
+# Deadline for one Gemini call, enforced both here and by the SDK's transport
+REQUEST_TIMEOUT_SECONDS = 90.0
+# Token counts remembered by text digest, so repeated parts are counted once
+TOKEN_COUNT_CACHE_SIZE = 4096
+
+# Used by the fallback that salvages questions from free-form text
+_SENTENCE_SPLIT_RE = re.compile(r"[.!?]\s+")
+_QUESTION_HINT_RE = re.compile(
+    r"Question:\s*(.*?)(?=Answer:|$)"
+    r"|\?\s*\n"  # Question marks
+    r"|قارن|اشرح|ما هو|كيف|لماذا"  # Arabic question words
+    r"|Compare|Explain|What is|How|Why",  # English question words
+    re.IGNORECASE,
+)
+
+# Reply length caps per task and per language, so short tasks cannot ramble up to a shared ceiling
+SUMMARY_MAX_OUTPUT_TOKENS = 800
+EXPLANATION_MAX_OUTPUT_TOKENS = 1500
+EXERCISES_MAX_OUTPUT_TOKENS = 2500
+
+# Per-call generation settings that make Gemini return exercises as a JSON array
+EXERCISES_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "question": {"type": "string"},
+                "answer": {"type": "string"},
+            },
+            "required": ["question", "answer"],
+        },
+    },
+}
+
+# The prompts below keep their fixed instructions first and the per-request
+# parts (language instruction, course text) last, so consecutive requests share
+# the longest possible prefix for Gemini's implicit prompt caching.
+
+# Summary prompt; filled with (language instruction, course text)
+SUMMARY_PROMPT_TMPL: Final[str] = """
+Create a comprehensive and well-structured summary of the educational content given at the end.
+
+Your summary should be:
+
+REQUIREMENTS:
+• Clear and concise while maintaining essential information
+• Organized with proper sections and bullet points
+• Include key concepts, definitions, and main ideas
+• Highlight important formulas, theories, or principles
+• Professional formatting for better readability
+• Suitable for student review and quick reference
+
+STRUCTURED SUMMARY:
+
+## Main Topic & Objective
+[Clearly state what this content covers]
+
+## Key Concepts
+• [List main concepts with brief explanations]
+
+## Important Details
+• [Include crucial facts, formulas, or data]
+
+## Examples & Applications
+• [Provide practical examples or use cases]
+
+## 📌 Key Takeaways
+• [List the most important points to remember]
+
+%s
+
+CONTENT TO SUMMARIZE:
+%s
+
+Summary:
+"""
+
+# Arabic explanation prompt; filled with the course text
+ARABIC_PROMPT_TMPL: Final[str] = """
+اشرح المحتوى التعليمي الوارد في النهاية بالعربية بطريقة شاملة ومفصلة.
+
+المطلوب في الشرح:
+• شرح واضح ومفصل باستخدام لغة بسيطة ومفهومة
+• تقسيم المفاهيم المعقدة إلى أجزاء سهلة الفهم
+• إدراج أمثلة عملية وتطبيقية من الحياة اليومية
+• استخدام التنسيق المهني لسهولة القراءة
+• توضيح الصيغ أو النظريات المهمة مع شرحها
+• ربط المفاهيم ببعضها البعض
+
+الشرح التفصيلي بالعربية:
+
+## نظرة عامة
+[مقدمة موجزة عن الموضوع]
+
+## المفاهيم الأساسية
+[شرح المفاهيم الرئيسية بالتفصيل]
+
+## أمثلة عملية
+[أمثلة واضحة من الحياة اليومية]
+
+## الروابط والعلاقات
+[كيف ترتبط هذه المفاهيم مع بعضها]
+
+## نصائح للفهم والحفظ
+[استراتيجيات لفهم وتذكر المعلومات]
+
+المحتوى التعليمي:
+%s
+
+الشرح:
+"""
+
+# Arabic then English explanation in a single reply; filled with the course text
+BILINGUAL_PROMPT_TMPL: Final[str] = """
+Provide two comprehensive and detailed explanations of the educational content given at the end,
+one in English and one in Arabic.
+
+EXPLANATION REQUIREMENTS (for both languages):
+• Clear and detailed explanation using simple, understandable language
+• Break down complex concepts into easily digestible parts
+• Include practical examples from everyday life and real-world applications
+• Use professional formatting for better readability
+• Explain important formulas or theories with context
+• Show connections between different concepts
+• Provide memory aids and learning tips
+
+Use these sections in each language:
+
+## Overview / نظرة عامة
+## Core Concepts / المفاهيم الأساسية
+## Practical Examples / أمثلة عملية
+## Connections & Relationships / الروابط والعلاقات
+## Learning Tips & Memory Aids / نصائح للفهم والحفظ
+
+Output the English explanation first between the markers <<<EN>>> and <<<END_EN>>>,
+then the Arabic explanation between the markers <<<AR>>> and <<<END_AR>>>.
+
+EDUCATIONAL CONTENT:
+%s
+"""
+
+# English explanation prompt; filled with the course text
+ENGLISH_PROMPT_TMPL: Final[str] = """
+Provide a comprehensive and detailed explanation of the educational content given at the end.
+
+EXPLANATION REQUIREMENTS:
+• Clear and detailed explanation using simple, understandable language
+• Break down complex concepts into easily digestible parts
+• Include practical examples from everyday life and real-world applications
+• Use professional formatting for better readability
+• Explain important formulas or theories with context
+• Show connections between different concepts
+• Provide memory aids and learning tips
+
+DETAILED EXPLANATION:
+
+## Overview
+[Brief introduction to the topic]
+
+## Core Concepts
+[Detailed explanation of main concepts]
+
+
+## Practical Examples
+[Clear examples from everyday life]
+
+## Connections & Relationships
+[How these concepts relate to each other]
+
+## Learning Tips & Memory Aids
+[Strategies for understanding and remembering]
+
+## Practice Applications
+[How to apply this knowledge]
+
+EDUCATIONAL CONTENT:
+%s
+
+Explanation:
+"""
+
+# Exercises prompt; filled with (language instruction, course text)
+EXERCISES_PROMPT_TMPL: Final[str] = """
+Create 5 comprehensive educational exercises based on the course content given at the end.
+The exercises should cover different skill levels and question types.
+
+Return a JSON array of exactly 5 objects, each with a "question" field holding a clear,
+specific question and an "answer" field holding a detailed answer with explanations.
+
+EXERCISE REQUIREMENTS:
+• Include variety: multiple choice, short answer, problem-solving, application questions
+• Progress from basic understanding to advanced application
+• Provide detailed, educational answers with explanations
+• Include step-by-step solutions where appropriate
+• Add learning tips and common mistakes to avoid
+• Make questions specific and clear, not generic
+
+%s
+
+COURSE CONTENT:
+%s
+
+Generate the exercises now:
+"""
+
+# Language instructions by normalized language preference
+SUMMARY_LANGUAGE_INSTRUCTIONS: Final[Dict[str, str]] = {
+    'arabic': "يرجى كتابة الملخص باللغة العربية بشكل كامل.",
+    'both': "Please provide the summary in both English and Arabic languages.",
+    'english': "Please write the summary in English.",
+}
+EXERCISES_LANGUAGE_INSTRUCTIONS: Final[Dict[str, str]] = {
+    'arabic': "يرجى كتابة التمارين والأسئلة والأجوبة باللغة العربية بشكل كامل.",
+    'both': "Please provide exercises in both English and Arabic languages.",
+    'english': "Please write all exercises, questions, and answers in English.",
+}
+
+# Explanation prompt by language preference; 'both' asks for both languages in
+# one request so the course text is sent only once
+EXPLANATION_PROMPTS: Final[Dict[str, str]] = {
+    'arabic': ARABIC_PROMPT_TMPL,
+    'both': BILINGUAL_PROMPT_TMPL,
+    'english': ENGLISH_PROMPT_TMPL,
+}
+
+
+def _normalize_language(language_preference: str) -> str:
+    """Return 'english', 'arabic' or 'both' for a language preference in any case; unknown means English."""
+    language = language_preference.strip().casefold()
+    return language if language in EXPLANATION_PROMPTS else 'english'
+
+
+# Canned responses served when the Gemini API cannot be reached
+FALLBACK_SUMMARY: Final[str] = """# Summary
 
 The AI service is currently experiencing high demand. Here are some general study tips:
 
@@ -136,8 +301,7 @@ The AI service is currently experiencing high demand. Here are some general stud
 
 *Please try again in a few moments when the AI service is less busy.*"""
 
-        elif "explain" in prompt.lower():
-            return """# Explanation
+FALLBACK_EXPLANATION: Final[str] = """# Explanation
 
 The AI service is currently busy processing other requests. Here's how you can approach understanding complex topics:
 
@@ -156,8 +320,7 @@ The AI service is currently busy processing other requests. Here's how you can a
 
 *The AI service will be available again shortly. Please try your request again.*"""
 
-        elif "exercise" in prompt.lower():
-            return """# Practice Exercises
+FALLBACK_EXERCISES: Final[str] = """# Practice Exercises
 
 The AI service is currently overloaded. Here are some general study exercises you can try:
 
@@ -185,8 +348,7 @@ The AI service is currently overloaded. Here are some general study exercises yo
 
 *Please try again when the AI service is less busy for personalized exercises.*"""
 
-        else:
-            return """# Service Temporarily Unavailable
+FALLBACK_GENERIC: Final[str] = """# Service Temporarily Unavailable
 
 The AI service is currently experiencing high demand and is temporarily overloaded. 
 
@@ -202,41 +364,823 @@ The AI service is currently experiencing high demand and is temporarily overload
 • Seek help from teachers or tutors
 
 *We apologize for the inconvenience. Please try your request again shortly.*"""
+
+# Fallback by keyword found in the lowercased prompt, checked in order
+FALLBACK_BY_KEYWORD: Final[Tuple[Tuple[str, str], ...]] = (
+    ("summarize", FALLBACK_SUMMARY),
+    ("explain", FALLBACK_EXPLANATION),
+    ("اشرح", FALLBACK_EXPLANATION),
+    ("exercise", FALLBACK_EXERCISES),
+)
+
+_FALLBACK_RESPONSES: Final[frozenset] = frozenset(
+    (FALLBACK_SUMMARY, FALLBACK_EXPLANATION, FALLBACK_EXERCISES, FALLBACK_GENERIC)
+)
+
+
+def _is_fallback(text: str) -> bool:
+    """Whether text is one of the canned replies sent while the API is unavailable."""
+    return text in _FALLBACK_RESPONSES
+
+
+class ResponseCache:
+    """Thread-safe LRU of Gemini responses with a TTL and an optional SQLite tier."""
+    
+    def __init__(self, max_size: int, ttl_seconds: int, disk_path: str = '', disk_ttl_seconds: int = 0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.disk_ttl_seconds = disk_ttl_seconds
+        self.stats = {"hits": 0, "misses": 0}
+        # key -> (stored_at, text), least recently used first
+        self._entries: "OrderedDict[bytes, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Optional SQLite file that keeps responses across restarts
+        self._disk = self._open_disk(disk_path)
+        self._disk_lock = threading.Lock()
+    
+    def get(self, key: bytes) -> Optional[str]:
+        """Return a cached response if it exists and has not expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, text = entry
+                if time.monotonic() - stored_at < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return text
+                del self._entries[key]
+        
+        text = self._disk_get(key)
+        if text is not None:
+            self._memory_put(key, text)
+        with self._lock:
+            self.stats["hits" if text is not None else "misses"] += 1
+        return text
+    
+    def put(self, key: bytes, text: str) -> None:
+        """Store a response in memory and, when enabled, on disk."""
+        self._memory_put(key, text)
+        self._disk_put(key, text)
+    
+    def clear(self) -> None:
+        """Drop all cached responses."""
+        with self._lock:
+            self._entries.clear()
+        if self._disk is None:
+            return
+
+        try:
+            with self._disk_lock:
+                self._disk.execute("DELETE FROM responses")
+        except sqlite3.Error as e:
+            logger.warning("Gemini disk cache clear failed: %s", e)
+    
+    def close(self) -> None:
+        """Close the disk tier if it is open."""
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+    
+    def _memory_put(self, key: bytes, text: str) -> None:
+        """Store a response, evicting the least recently used entries when full."""
+        if self.max_size <= 0:
+            return
+        
+        with self._lock:
+            self._entries[key] = (time.monotonic(), text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def _open_disk(self, path: str) -> Optional[sqlite3.Connection]:
+        """Open the SQLite response cache at path, or return None if it is disabled."""
+        if not path:
+            return None
+        
+        try:
+            connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key BLOB PRIMARY KEY, stored_at REAL NOT NULL, text TEXT NOT NULL)"
+            )
+            logger.info("Gemini disk cache opened at %s", path)
+            return connection
+        except sqlite3.Error as e:
+            logger.warning("Gemini disk cache disabled, failed to open %s: %s", path, e)
+            return None
+    
+    def _disk_get(self, key: bytes) -> Optional[str]:
+        """Return a response from the disk cache if it has not expired."""
+        if self._disk is None:
+            return None
+        
+        try:
+            with self._disk_lock:
+                row = self._disk.execute(
+                    "SELECT text FROM responses WHERE key = ? AND stored_at > ?",
+                    (key, time.time() - self.disk_ttl_seconds)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("Gemini disk cache read failed: %s", e)
+            return None
+        return row[0] if row else None
+    
+    def _disk_put(self, key: bytes, text: str) -> None:
+        """Write a response through to the disk cache."""
+        if self._disk is None:
+            return
+        
+        try:
+            with self._disk_lock:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO responses (key, stored_at, text) VALUES (?, ?, ?)",
+                    (key, time.time(), text)
+                )
+        except sqlite3.Error as e:
+            logger.warning("Gemini disk cache write failed: %s", e)
+
+
+class RateLimiter:
+    """Token bucket shared by every request thread and event loop."""
+    
+    def __init__(self, requests_per_minute: float):
+        self._lock = threading.Lock()
+        self._rate = requests_per_minute / 60
+        self._capacity = max(1.0, self._rate)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+    
+    @property
+    def rate_per_minute(self) -> float:
+        return self._rate * 60
+    
+    def set_rate(self, requests_per_minute: float) -> None:
+        """Change the refill rate; the bucket holds at most one second of requests."""
+        with self._lock:
+            self._refill()
+            self._rate = requests_per_minute / 60
+            self._capacity = max(1.0, self._rate)
+            self._tokens = min(self._tokens, self._capacity)
+    
+    async def acquire(self) -> None:
+        """Wait until a request may be sent."""
+        with self._lock:
+            self._refill()
+            # Reserve a token now so waiters are served in arrival order
+            self._tokens -= 1
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # Give the reserved token back so a timed-out caller does not delay later ones
+                with self._lock:
+                    self._refill()
+                    self._tokens = min(self._capacity, self._tokens + 1)
+                raise
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+class ConcurrencyLimiter:
+    """Semaphore shared by every request thread and event loop."""
+    
+    def __init__(self, limit: int):
+        self._lock = threading.Lock()
+        self._available = limit
+        self._waiters: Deque[concurrent.futures.Future] = deque()
+    
+    async def acquire(self) -> None:
+        """Wait for a free slot; slots are granted in arrival order."""
+        with self._lock:
+            if self._available > 0 and not self._waiters:
+                self._available -= 1
+                return
+            waiter: concurrent.futures.Future = concurrent.futures.Future()
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wrap_future(waiter)
+        except asyncio.CancelledError:
+            # Pass the slot on if it was granted while we were being cancelled
+            if not waiter.cancel():
+                self.release()
+            raise
+    
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_result(None)
+                    return
+            self._available += 1
+    
+    async def __aenter__(self) -> None:
+        await self.acquire()
+    
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class CircuitBreaker:
+    """Opens for a cooldown after consecutive failures so callers stop waiting on a down API."""
     
-    async def _generate_content_internal(self, prompt: str) -> str:
+    def __init__(self, threshold: int, cooldown_seconds: float):
+        self._lock = threading.Lock()
+        self._threshold = threshold
+        self._cooldown = cooldown_seconds
+        self._failures = 0
+        self._opened_until = 0.0
+    
+    def is_open(self) -> bool:
+        return time.monotonic() < self._opened_until
+    
+    def record_failure(self) -> None:
+        """Count a failure, opening the breaker once the threshold is reached."""
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self._threshold:
+                # After the cooldown one failed probe is enough to open it again
+                self._opened_until = time.monotonic() + self._cooldown
+    
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_until = 0.0
+
+
+class JsonObjectScanner:
+    """Picks the complete objects out of a JSON array while its text is still arriving."""
+    
+    def __init__(self):
+        self._current: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+    
+    def feed(self, chunk: str) -> List[str]:
+        """Return the JSON text of every array element object completed by chunk."""
+        completed = []
+        for char in chunk:
+            if self._depth > 1:
+                self._current.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '[{':
+                self._depth += 1
+                if self._depth == 2:
+                    self._current = [char]
+            elif char in ']}':
+                self._depth -= 1
+                if self._depth == 1 and char == '}':
+                    completed.append(''.join(self._current))
+        return completed
+
+
+class SemanticCacheEntry(NamedTuple):
+    """A response stored with the unit-length embedding of its course text."""
+    stored_at: float
+    vector: Tuple[float, ...]
+    task: str
+    language: str
+    response: str
+
+
+class SemanticCache:
+    """Responses for earlier course texts, matched by embedding cosine similarity."""
+    
+    def __init__(self, threshold: float, max_size: int, ttl_seconds: int):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: List[SemanticCacheEntry] = []
+        self._lock = threading.Lock()
+    
+    def lookup(self, vector: Tuple[float, ...], task: str, language: str) -> Optional[str]:
+        """Return the best response at or above the threshold for the same task and language."""
+        expires_before = time.monotonic() - self.ttl_seconds
+        best_score, best_response = self.threshold, None
+        with self._lock:
+            self._entries = [entry for entry in self._entries if entry.stored_at > expires_before]
+            for entry in self._entries:
+                if entry.task != task or entry.language != language:
+                    continue
+                # Vectors are unit length, so the dot product is the cosine similarity
+                score = sum(map(operator.mul, vector, entry.vector))
+                if score >= best_score:
+                    best_score, best_response = score, entry.response
+        return best_response
+    
+    def add(self, vector: Tuple[float, ...], task: str, language: str, response: str) -> None:
+        """Remember a response, dropping the oldest entries when full."""
+        with self._lock:
+            self._entries.append(SemanticCacheEntry(time.monotonic(), vector, task, language, response))
+            del self._entries[:-self.max_size]
+
+
+def _output_config(max_output_tokens: int, language: str,
+                   base: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Per-call generation settings capping the reply length; 'both' gets the cap for each language."""
+    if language == 'both':
+        max_output_tokens *= 2
+    return {**(base or {}), "max_output_tokens": max_output_tokens}
+
+
+class GeminiService:
+    """Service for interacting with Google's Gemini API."""
+    
+    def __init__(self):
+        self.config = get_config()
+        self._configure_api()
+        self.model = None
+        self._generation_settings = {
+            "temperature": self.config.TEMPERATURE,
+            "top_p": 0.8,
+            "top_k": 40
+        }
+        self._initialize_model()
+        self.max_retries = 3
+        self.base_delay = 1.0  # seconds
+        self.max_backoff = 20.0  # seconds
+        # Model and generation settings shape every response, so they prefix each cache key
+        self._cache_key_prefix = orjson.dumps(
+            {"model": self.config.GEMINI_MODEL, **self._generation_settings}, option=orjson.OPT_SORT_KEYS
+        ) + b"|"
+        self.cache = ResponseCache(
+            max_size=self.config.GEMINI_CACHE_SIZE,
+            ttl_seconds=self.config.GEMINI_CACHE_TTL_SECONDS,
+            disk_path=self.config.GEMINI_DISK_CACHE_PATH,
+            disk_ttl_seconds=self.config.GEMINI_DISK_CACHE_TTL_SECONDS
+        )
+        # Opt-in reuse of answers for paraphrased course texts
+        self.semantic_cache = None
+        if self.config.GEMINI_SEMANTIC_CACHE_THRESHOLD > 0:
+            self.semantic_cache = SemanticCache(
+                threshold=self.config.GEMINI_SEMANTIC_CACHE_THRESHOLD,
+                max_size=self.config.GEMINI_SEMANTIC_CACHE_SIZE,
+                ttl_seconds=self.config.GEMINI_CACHE_TTL_SECONDS
+            )
+        self._token_counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self._token_counts_lock = threading.Lock()
+        # Pending calls by cache key so identical concurrent prompts share one request
+        self._inflight: Dict[bytes, concurrent.futures.Future] = {}
+        self._inflight_lock = threading.Lock()
+        # Optional cap on the request rate, adjusted down when Gemini pushes back
+        self._limiter = RateLimiter(self.config.GEMINI_RPM) if self.config.GEMINI_RPM > 0 else None
+        # Optional fast fallback while Gemini is overloaded or timing out
+        self._breaker = None
+        if self.config.GEMINI_BREAKER_THRESHOLD > 0:
+            self._breaker = CircuitBreaker(
+                threshold=self.config.GEMINI_BREAKER_THRESHOLD,
+                cooldown_seconds=self.config.GEMINI_BREAKER_COOLDOWN_SECONDS
+            )
+        # Generation calls wait for a slot here, before their timeout starts, rather
+        # than queueing inside the executor with the clock already running
+        self._slots = ConcurrencyLimiter(self.config.GEMINI_MAX_CONCURRENCY)
+        # Dedicated pool for the blocking SDK calls; its size bounds concurrent API calls
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.config.GEMINI_MAX_CONCURRENCY,
+            thread_name_prefix="gemini"
+        )
+    
+    def set_rate_limit(self, requests_per_minute: float) -> None:
+        """Change the Gemini request rate; ignored when rate limiting is disabled."""
+        if self._limiter is not None:
+            self._limiter.set_rate(requests_per_minute)
+            logger.info("Gemini rate limit set to %.1f requests per minute", requests_per_minute)
+    
+    def _adjust_rate_limit(self, throttled: bool) -> None:
+        """Halve the rate when Gemini pushes back, then recover by one request per minute per success."""
+        if self._limiter is None:
+            return
+        
+        current = self._limiter.rate_per_minute
+        if throttled:
+            self.set_rate_limit(max(1.0, current / 2))
+        elif current < self.config.GEMINI_RPM:
+            # Recovery runs on every success, so only reaching the full rate is logged at INFO
+            rate = min(self.config.GEMINI_RPM, current + 1)
+            self._limiter.set_rate(rate)
+            if rate == self.config.GEMINI_RPM:
+                logger.info("Gemini rate limit recovered to %.1f requests per minute", rate)
+            else:
+                logger.debug("Gemini rate limit raised to %.1f requests per minute", rate)
+    
+    def _configure_api(self) -> None:
+        """Configure the Gemini API with API key."""
+        try:
+            # The SDK builds one client per process, so every worker thread
+            # shares the same long-lived channel and its connections
+            genai.configure(api_key=self.config.GEMINI_API_KEY, transport=self.config.GEMINI_TRANSPORT)
+            logger.info("Gemini API configured successfully")
+        except Exception as e:
+            logger.error("Failed to configure Gemini API: %s", e)
+            raise
+    
+    def _initialize_model(self) -> None:
+        """Initialize the Gemini model with safety settings."""
+        try:
+            # Safety settings to handle educational content appropriately
+            safety_settings = {
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            }
+            
+            # Generation configuration with timeout settings
+            generation_config = genai.types.GenerationConfig(**self._generation_settings)
+            
+            self.model = genai.GenerativeModel(
+                model_name=self.config.GEMINI_MODEL,
+                safety_settings=safety_settings,
+                generation_config=generation_config
+            )
+            logger.info("Gemini model '%s' initialized successfully", self.config.GEMINI_MODEL)
+        except Exception as e:
+            logger.error("Failed to initialize Gemini model: %s", e)
+            raise
+    
+    def close(self) -> None:
+        """Shut down the worker pool used for Gemini API calls and the disk cache."""
+        self._executor.shutdown(wait=True)
+        self.cache.close()
+    
+    async def test_connection(self) -> bool:
+        """Test the connection to Gemini API."""
+        try:
+            test_prompt = "Say hello"
+            response = await self._generate_content_with_retry(test_prompt)
+            logger.info("Gemini API connection test successful")
+            return True
+        except Exception as e:
+            logger.error("Gemini API connection test failed: %s", e)
+            return False
+    
+    async def _generate_content_with_retry(self, prompt: str,
+                                           generation_config: Optional[Dict[str, Any]] = None) -> str:
+        """Generate content with retry logic and improved error handling."""
+        max_retries = self.max_retries
+        max_backoff = self.max_backoff
+        max_timeout = REQUEST_TIMEOUT_SECONDS
+        delay = self.base_delay
+        
+        def backoff() -> float:
+            # Decorrelated jitter: each wait is drawn from base..3x the previous one,
+            # so concurrent callers spread out instead of retrying in lockstep
+            nonlocal delay
+            delay = min(max_backoff, random.uniform(self.base_delay, delay * 3))
+            return delay
+        
+        for attempt in range(max_retries):
+            if self._breaker is not None and self._breaker.is_open():
+                logger.warning("Gemini circuit breaker is open, skipping the API call")
+                return self._get_fallback_response(prompt)
+            try:
+                logger.info("Attempting to generate content with Gemini (attempt %d/%d)...", attempt + 1, max_retries)
+                
+                # Wait for the rate limit before taking a slot, so the wait neither
+                # holds a slot nor counts against the request timeout
+                if self._limiter is not None:
+                    await self._limiter.acquire()
+                # asyncio.timeout cancels in place, without wait_for's extra task
+                async with asyncio.timeout(max_timeout):
+                    response = await self._generate_content_internal(prompt, generation_config)
+                
+                self._adjust_rate_limit(throttled=False)
+                if self._breaker is not None:
+                    self._breaker.record_success()
+                return response
+            except asyncio.TimeoutError:
+                logger.error("Request timed out after %s seconds (attempt %d)", max_timeout, attempt + 1)
+                if self._breaker is not None:
+                    self._breaker.record_failure()
+                if attempt == max_retries - 1:
+                    raise Exception("The AI service is currently busy. Please try again in a moment with shorter content.")
+                await asyncio.sleep(backoff())
+            except Exception as e:
+                error_str = str(e).lower()
+                if "rate limiting" in error_str:
+                    logger.error("Gemini API rate limit hit (attempt %d): %s", attempt + 1, e)
+                    self._adjust_rate_limit(throttled=True)
+                    if attempt == max_retries - 1:
+                        return self._get_fallback_response(prompt)
+                    # Quota frees up quickly; short jittered waits keep callers from retrying in lockstep
+                    await asyncio.sleep(random.uniform(0, min(4.0, 0.5 * (2 ** attempt))))
+                elif "503" in error_str or "overloaded" in error_str:
+                    logger.error("Gemini API overloaded (attempt %d): %s", attempt + 1, e)
+                    self._adjust_rate_limit(throttled=True)
+                    if self._breaker is not None:
+                        self._breaker.record_failure()
+                    if attempt == max_retries - 1:
+                        return self._get_fallback_response(prompt)
+                    retry_after = self._retry_after(e)
+                    await asyncio.sleep(min(max_backoff, retry_after) if retry_after is not None else backoff())
+                elif self._is_timeout(e):
+                    logger.error("Request timeout (attempt %d): %s", attempt + 1, e)
+                    if self._breaker is not None:
+                        self._breaker.record_failure()
+                    if attempt == max_retries - 1:
+                        raise Exception("Request timed out. Please try again with shorter content.")
+                    await asyncio.sleep(backoff())
+                else:
+                    logger.error("Error generating content (attempt %d): %s", attempt + 1, e)
+                    if attempt == max_retries - 1:
+                        return self._get_fallback_response(prompt)
+                    await asyncio.sleep(backoff())
+
+    @staticmethod
+    def _is_timeout(error: BaseException) -> bool:
+        """Whether error, or the SDK error it was raised from, is a timeout."""
+        cause = error.__cause__ or error
+        cause_str = str(cause).lower()
+        return (isinstance(cause, (DeadlineExceeded, TimeoutError))
+                or "timeout" in cause_str or "deadline exceeded" in cause_str)
+    
+    @classmethod
+    def _trips_breaker(cls, error: BaseException) -> bool:
+        """Whether error means Gemini is overloaded or timing out, as opposed to a bad request."""
+        cause = error.__cause__ or error
+        cause_str = str(cause).lower()
+        return (cls._is_timeout(error) or isinstance(cause, ServiceUnavailable)
+                or "503" in cause_str or "overloaded" in cause_str)
+    
+    @staticmethod
+    def _retry_after(error: BaseException) -> Optional[float]:
+        """Return the Retry-After delay in seconds sent with the API error behind error, if any."""
+        response = getattr(error.__cause__, 'response', None)
+        value = (getattr(response, 'headers', None) or {}).get('Retry-After')
+        try:
+            return max(0.0, float(value)) if value else None
+        except ValueError:
+            # HTTP-date values are rare for this API; fall back to jittered backoff
+            return None
+    
+    def _get_fallback_response(self, prompt: str) -> str:
+        """Generate a fallback response when API is unavailable."""
+        logger.warning("Using fallback response due to API issues")
+        
+        prompt = prompt.lower()
+        for keyword, response in FALLBACK_BY_KEYWORD:
+            if keyword in prompt:
+                return response
+        return FALLBACK_GENERIC
+    
+    async def _run_in_slot(self, func: Callable[[], Any]) -> Any:
+        """
+        Run func on the executor under a concurrency slot.
+        
+        The slot is freed when the worker finishes rather than when the caller stops
+        waiting, so a call abandoned on timeout still counts against the limit.
+        """
+        await self._slots.acquire()
+        try:
+            future = self._executor.submit(func)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+    
+    async def _generate_content_internal(self, prompt: str,
+                                         generation_config: Optional[Dict[str, Any]] = None) -> str:
         """Internal method to generate content."""
         try:
-            # Generate content synchronously but in a thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None, 
-                lambda: self.model.generate_content(prompt)
+            # Generate content synchronously but in a thread pool to avoid blocking.
+            # generate_content_async is not used: the SDK caches one grpc.aio client
+            # per process, bound to the first event loop, while async_route runs
+            # every request on a fresh loop that is closed afterwards.
+            response = await self._run_in_slot(
+                functools.partial(
+                    self.model.generate_content,
+                    prompt,
+                    generation_config=generation_config,
+                    # Without a transport deadline a call abandoned on timeout keeps its worker thread
+                    request_options={'timeout': REQUEST_TIMEOUT_SECONDS}
+                )
             )
             
             if not response or not response.text:
                 raise ValueError("Empty response from Gemini API")
             
-            logger.info(f"Generated content successfully. Length: {len(response.text)} characters")
-            return response.text.strip()
+            logger.info("Generated content successfully. Length: %d characters", len(response.text))
+            text = response.text.strip()
+            # Only real responses are cached, never the fallback text
+            self.cache.put(self._cache_key(prompt, generation_config), text)
+            return text
         except Exception as e:
-            logger.error(f"Internal content generation failed: {e}")
+            logger.error("Internal content generation failed: %s", e)
             error_str = str(e).lower()
-            # Re-raise with more specific error message
-            if "timeout" in error_str:
-                raise Exception("Request timed out. Please try again with shorter content or check your internet connection.")
-            elif "503" in error_str or "overloaded" in error_str or "rate limit" in error_str:
-                raise Exception("The AI service is currently overloaded. Please try again later.")
+            # Re-raise with more specific error message; the SDK error stays as __cause__
+            if self._is_timeout(e):
+                raise Exception("Request timed out. Please try again with shorter content or check your internet connection.") from e
+            elif isinstance(e, ResourceExhausted) or "429" in error_str or "rate limit" in error_str:
+                raise Exception("The AI service is rate limiting requests. Please try again later.") from e
+            elif "503" in error_str or "overloaded" in error_str:
+                raise Exception("The AI service is currently overloaded. Please try again later.") from e
             elif "connection" in error_str or "network" in error_str:
-                raise Exception("Unable to connect to AI service. Please check your internet connection and try again.")
+                raise Exception("Unable to connect to AI service. Please check your internet connection and try again.") from e
             else:
-                raise Exception(f"AI service error: {str(e)}")
+                raise Exception(f"AI service error: {str(e)}") from e
+    
+    async def _generate_content_stream(self, prompt: str,
+                                       generation_config: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Yield response text as Gemini produces it.
+        
+        The blocking streaming call runs on the worker pool and hands each
+        chunk to this event loop through a queue. It holds a concurrency slot
+        until the worker is done, which may be after the consumer stops.
+        
+        Args:
+            prompt: The prompt to send
+            generation_config: Optional overrides of the model's generation settings
+            
+        Yields:
+            str: Response text pieces in order, or the fallback message if the
+            API fails before anything was produced
+        """
+        # A cached reply is sent whole; it is already complete
+        key = self._cache_key(prompt, generation_config)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        if self._breaker is not None and self._breaker.is_open():
+            yield self._get_fallback_response(prompt)
+            return
+        
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        finished = object()
+        stopped = threading.Event()
+        
+        def hand_over(item: Any) -> None:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                # The consumer's loop has already been closed
+                stopped.set()
+        
+        def produce() -> None:
+            try:
+                # The transport deadline keeps a stalled stream from pinning its worker thread
+                chunks = self.model.generate_content(
+                    prompt,
+                    generation_config=generation_config,
+                    stream=True,
+                    request_options={'timeout': REQUEST_TIMEOUT_SECONDS}
+                )
+                for chunk in chunks:
+                    if stopped.is_set():
+                        return
+                    if chunk.text:
+                        hand_over(chunk.text)
+            except Exception as e:
+                hand_over(e)
+            finally:
+                self._slots.release()
+                hand_over(finished)
+        
+        if self._limiter is not None:
+            await self._limiter.acquire()
+        await self._slots.acquire()
+        try:
+            loop.run_in_executor(self._executor, produce)
+        except BaseException:
+            self._slots.release()
+            raise
+        pieces: List[str] = []
+        try:
+            while True:
+                item = await queue.get()
+                if item is finished:
+                    if self._breaker is not None:
+                        self._breaker.record_success()
+                    if pieces:
+                        # Only complete replies are cached, so a later buffered call can reuse them
+                        self.cache.put(key, ''.join(pieces).strip())
+                    break
+                if isinstance(item, Exception):
+                    if self._breaker is not None and self._trips_breaker(item):
+                        self._breaker.record_failure()
+                    if pieces:
+                        raise item
+                    logger.error("Failed to stream content from Gemini: %s", item)
+                    yield self._get_fallback_response(prompt)
+                    break
+                pieces.append(item)
+                yield item
+        finally:
+            # Lets the worker stop early if the client went away mid-stream
+            stopped.set()
     
-    async def _generate_content(self, prompt: str) -> str:
-        """Generate content using Gemini API with error handling and retry logic."""
+    def _cache_key(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None) -> bytes:
+        """Hash the prompt together with the settings that shape the response."""
+        key = hashlib.blake2b(self._cache_key_prefix, digest_size=16)
+        if generation_config:
+            key.update(orjson.dumps(generation_config, option=orjson.OPT_SORT_KEYS))
+        key.update(b"|")
+        key.update(prompt.encode('utf-8'))
+        return key.digest()
+    
+    def cache_clear(self) -> None:
+        """Drop all cached responses."""
+        self.cache.clear()
+    
+    async def _embed(self, text: str) -> Optional[Tuple[float, ...]]:
+        """Return the unit-length embedding of text, or None if embedding fails."""
         try:
-            return await self._generate_content_with_retry(prompt)
+            result = await self._run_in_slot(
+                functools.partial(genai.embed_content, model=self.config.GEMINI_EMBEDDING_MODEL, content=text)
+            )
         except Exception as e:
-            logger.error(f"Failed to generate content with Gemini: {e}")
+            logger.warning("Failed to embed text for the semantic cache: %s", e)
+            return None
+        
+        vector = result["embedding"]
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return tuple(x / norm for x in vector)
+    
+    async def _generate_for_text(self, text: str, task: str, language: str, prompt: str,
+                                 generation_config: Optional[Dict[str, Any]] = None) -> str:
+        """Generate content for a course text, reusing the answer for a near-identical text if enabled."""
+        if self.semantic_cache is None:
+            return await self._generate_content(prompt, generation_config)
+        
+        # An exact repeat needs no embedding round trip
+        cached = self.cache.get(self._cache_key(prompt, generation_config))
+        if cached is not None:
+            return cached
+        vector = await self._embed(text)
+        if vector is not None:
+            cached = self.semantic_cache.lookup(vector, task, language)
+            if cached is not None:
+                logger.info("Returning semantically cached %s response", task)
+                return cached
+        
+        # The exact cache was checked above, so a second lookup would only count another miss
+        result = await self._generate_content(prompt, generation_config, check_cache=False)
+        if vector is not None and not _is_fallback(result):
+            self.semantic_cache.add(vector, task, language, result)
+        return result
+    
+    async def _generate_content(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None,
+                                check_cache: bool = True) -> str:
+        """
+        Generate content using Gemini API with error handling and retry logic.
+        
+        Args:
+            prompt: The prompt to send
+            generation_config: Optional per-call settings merged over the model defaults
+            check_cache: False when the caller has already looked the prompt up in the cache
+            
+        Returns:
+            str: Generated text, or a fallback message if the API is unavailable
+        """
+        key = self._cache_key(prompt, generation_config)
+        cached = self.cache.get(key) if check_cache else None
+        if cached is not None:
+            logger.info("Returning cached Gemini response (hits=%d, misses=%d)",
+                        self.cache.stats["hits"], self.cache.stats["misses"])
+            return cached
+        
+        # Requests run on separate threads and event loops, so the shared
+        # result is a thread-safe concurrent Future awaited via wrap_future
+        with self._inflight_lock:
+            pending = self._inflight.get(key)
+            if pending is None:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+        
+        try:
+            if pending is not None:
+                logger.info("Waiting for an identical in-flight Gemini request")
+                return await asyncio.wrap_future(pending)
+            
+            try:
+                result = await self._generate_content_with_retry(prompt, generation_config)
+                future.set_result(result)
+                return result
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            finally:
+                with self._inflight_lock:
+                    self._inflight.pop(key, None)
+        except Exception as e:
+            logger.error("Failed to generate content with Gemini: %s", e)
             # Instead of raising, return fallback response for better user experience
             return self._get_fallback_response(prompt)
     
@@ -251,163 +1195,249 @@ The AI service is currently experiencing high demand and is temporarily overload
         Returns:
             str: Generated summary
         """
-        if not text or not text.strip():
-            raise ValueError("Input text cannot be empty")
-        
-        language_instruction = ""
-        if language_preference.lower() == 'arabic':
-            language_instruction = "يرجى كتابة الملخص باللغة العربية بشكل كامل."
-        elif language_preference.lower() == 'both':
-            language_instruction = "Please provide the summary in both English and Arabic languages."
-        else:
-            language_instruction = "Please write the summary in English."
+        language = _normalize_language(language_preference)
+        text = await self._condense(self._prepare(text), language)
+        if text is None:
+            return FALLBACK_SUMMARY
         
-        prompt = f"""
-        Create a comprehensive and well-structured summary of the following educational content.
-        {language_instruction}
-        
-        Your summary should be:
-        
-        REQUIREMENTS:
-        • Clear and concise while maintaining essential information
-        • Organized with proper sections and bullet points
-        • Include key concepts, definitions, and main ideas
-        • Highlight important formulas, theories, or principles
-        • Professional formatting for better readability
-        • Suitable for student review and quick reference
-        
-        CONTENT TO SUMMARIZE:
-        {text}
-        
-        STRUCTURED SUMMARY:
+        try:
+            summary = await self._summarize_part(text, language)
+            logger.info("Content summarized successfully")
+            return summary
+        except Exception as e:
+            logger.error("Failed to summarize content: %s", e)
+            raise
+    
+    async def summarize_content_stream(self, text: str, language_preference: str = 'english') -> AsyncIterator[str]:
+        """
+        Stream a summary of the educational content as it is generated.
         
-        ## Main Topic & Objective
-        [Clearly state what this content covers]
+        Args:
+            text: The course content to summarize
+            language_preference: Language for the summary ('english', 'arabic', or 'both')
+            
+        Yields:
+            str: Pieces of the summary in order
+        """
+        language = _normalize_language(language_preference)
+        text = await self._condense(self._prepare(text), language)
+        if text is None:
+            yield FALLBACK_SUMMARY
+            return
+        prompt = self._summary_prompt(text, language)
         
-        ## Key Concepts
-        • [List main concepts with brief explanations]
+        config = _output_config(SUMMARY_MAX_OUTPUT_TOKENS, language)
+        async for piece in self._generate_content_stream(prompt, config):
+            yield piece
+        logger.info("Content summary streamed successfully")
+    
+    def _prepare(self, text: str) -> str:
+        """Clean up course text before it is put into a prompt, rejecting text that cleans up to nothing."""
+        original_length = len(text)
+        text = _INVISIBLE_CHARS_RE.sub('', text)
+        # Page breaks become paragraph breaks so repeated page headers are deduplicated
+        text = _LINE_END_RE.sub('\n', text).replace('\f', '\n\n')
+        text = self._dedupe_paragraphs(_TRAILING_SPACE_RE.sub('', text))
+        if len(text) > COMPACT_TEXT_CHARS:
+            # Long extracted documents carry a lot of padding; keep the line structure
+            text = _HORIZONTAL_SPACE_RE.sub(' ', text)
         
-        ## Important Details
-        • [Include crucial facts, formulas, or data]
+        max_chars = self.config.GEMINI_MAX_INPUT_CHARS
+        if 0 < max_chars < len(text):
+            logger.warning("Course text truncated from %d to %d characters", len(text), max_chars)
+            text = text[:max_chars]
+        logger.debug("Prepared course text: %d -> %d characters", original_length, len(text))
+        # Checked after cleaning, so zero-width characters or bare line breaks count as empty
+        text = text.strip()
+        if not text:
+            raise ValueError("Input text cannot be empty")
+        return text
+    
+    async def _count_tokens(self, text: str) -> int:
+        """Count the tokens in text, estimating from its length if the API call fails."""
+        # count_tokens is a network round trip; key by digest so the text is not held twice
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        with self._token_counts_lock:
+            if key in self._token_counts:
+                self._token_counts.move_to_end(key)
+                return self._token_counts[key]
         
-        ## Examples & Applications
-        • [Provide practical examples or use cases]
+        try:
+            result = await self._run_in_slot(functools.partial(self.model.count_tokens, text))
+        except Exception as e:
+            logger.warning("Token count failed, estimating from length: %s", e)
+            return len(text) // 4 + 1
         
-        ## 📌 Key Takeaways
-        • [List the most important points to remember]
+        with self._token_counts_lock:
+            self._token_counts[key] = result.total_tokens
+            if len(self._token_counts) > TOKEN_COUNT_CACHE_SIZE:
+                self._token_counts.popitem(last=False)
+        return result.total_tokens
+    
+    async def _split_to_budget(self, text: str) -> List[str]:
+        """Split text into parts that each fit GEMINI_MAX_INPUT_TOKENS along with the prompt."""
+        if self.config.GEMINI_MAX_INPUT_TOKENS <= 0:
+            return [text]
+        budget = max(1, self.config.GEMINI_MAX_INPUT_TOKENS - PROMPT_OVERHEAD_TOKENS)
+        if len(text) <= budget:
+            # A token is practically never shorter than one character, so skip the API call
+            return [text]
         
-        Summary:
+        tokens = await self._count_tokens(text)
+        if tokens <= budget:
+            return [text]
+        return self._split_into_chunks(text, math.ceil(tokens / budget))
+    
+    async def _condense(self, text: str, language_preference: str) -> Optional[str]:
         """
+        Replace an over-budget text with the joined summaries of its parts (map-reduce).
         
-        try:
-            summary = await self._generate_content(prompt)
-            logger.info("Content summarized successfully")
-            return summary
-        except Exception as e:
-            logger.error(f"Failed to summarize content: {e}")
-            raise
+        Returns None if a part could only be answered with the fallback text,
+        so that boilerplate never becomes the course text of the reduce step.
+        """
+        chunks = await self._split_to_budget(text)
+        while len(chunks) > 1:
+            logger.info("Input over the token budget, summarizing %d parts first", len(chunks))
+            summaries = await self._map_chunks(self._summarize_part, chunks, language_preference)
+            if any(map(_is_fallback, summaries)):
+                logger.warning("Summarizing a part of the course text failed, skipping the reduce step")
+                return None
+            text = "\n\n".join(summaries)
+            remaining = await self._split_to_budget(text)
+            if len(remaining) >= len(chunks):
+                # The summaries are not getting shorter; send what we have
+                break
+            chunks = remaining
+        return text
     
-    async def explain_content(self, text: str, language_preference: str = 'english') -> str:
+    async def _map_chunks(self, method: Callable[[str, str], Awaitable[Any]],
+                          chunks: List[str], language_preference: str) -> List[Any]:
+        """Run a per-part method over chunks concurrently and raise the first failure, if any."""
+        results = await self._batch(method, chunks, language_preference, None)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+    
+    async def _summarize_part(self, text: str, language: str) -> str:
+        """Summarize prepared text that already fits the token budget, without splitting it again."""
+        prompt = self._summary_prompt(text, language)
+        return await self._generate_for_text(
+            text, 'summary', language, prompt, _output_config(SUMMARY_MAX_OUTPUT_TOKENS, language)
+        )
+    
+    async def _explain_part(self, text: str, language: str, fused: bool = True) -> str:
+        """Explain prepared text that already fits the token budget, without splitting it again."""
+        if language == 'both' and not fused:
+            return await self._explain_separately(text)
+        explanation = await self._generate_for_text(
+            text, 'explanation', language, EXPLANATION_PROMPTS[language] % text,
+            _output_config(EXPLANATION_MAX_OUTPUT_TOKENS, language)
+        )
+        if language == 'both':
+            explanation = await self._split_bilingual(text, explanation)
+        return explanation
+    
+    @staticmethod
+    def _dedupe_paragraphs(text: str) -> str:
+        """Drop exact repeats of a paragraph, such as page headers and footers, keeping the first."""
+        paragraphs = _PARAGRAPH_BREAK_RE.split(text)
+        return "\n\n".join(dict.fromkeys(p for p in paragraphs if p.strip()))
+    
+    def _summary_prompt(self, text: str, language: str) -> str:
+        """Build the summary prompt for a normalized language."""
+        return SUMMARY_PROMPT_TMPL % (SUMMARY_LANGUAGE_INSTRUCTIONS[language], text)
+    
+    async def explain_content(self, text: str, language_preference: str = 'english', fused: bool = True) -> str:
         """
         Generate detailed explanations based on language preference.
         
         Args:
             text: The course content to explain
-            language_preference: Language for the explanation ('english' or 'arabic')
+            language_preference: Language for the explanation ('english', 'arabic', or 'both')
+            fused: For 'both', ask for the two languages in one request rather than one request each
             
         Returns:
             str: Explanation in the requested language
         """
-        if not text or not text.strip():
-            raise ValueError("Input text cannot be empty")
-        
-        if language_preference.lower() == 'arabic':
-            # Arabic explanation prompt
-            prompt = f"""
-            اشرح المحتوى التعليمي التالي بالعربية بطريقة شاملة ومفصلة.
-            
-            المطلوب في الشرح:
-            • شرح واضح ومفصل باستخدام لغة بسيطة ومفهومة
-            • تقسيم المفاهيم المعقدة إلى أجزاء سهلة الفهم
-            • إدراج أمثلة عملية وتطبيقية من الحياة اليومية
-            • استخدام التنسيق المهني لسهولة القراءة
-            • توضيح الصيغ أو النظريات المهمة مع شرحها
-            • ربط المفاهيم ببعضها البعض
-            
-            المحتوى التعليمي:
-            {text}
-            
-            الشرح التفصيلي بالعربية:
-            
-            ## نظرة عامة
-            [مقدمة موجزة عن الموضوع]
-            
-            ## المفاهيم الأساسية
-            [شرح المفاهيم الرئيسية بالتفصيل]
-            
-            ## أمثلة عملية
-            [أمثلة واضحة من الحياة اليومية]
-            
-            ## الروابط والعلاقات
-            [كيف ترتبط هذه المفاهيم مع بعضها]
-            
-            ## نصائح للفهم والحفظ
-            [استراتيجيات لفهم وتذكر المعلومات]
-            
-            الشرح:
-            """
-        else:
-            # English explanation prompt
-            prompt = f"""
-            Provide a comprehensive and detailed explanation of the following educational content.
-            
-            EXPLANATION REQUIREMENTS:
-            • Clear and detailed explanation using simple, understandable language
-            • Break down complex concepts into easily digestible parts
-            • Include practical examples from everyday life and real-world applications
-            • Use professional formatting for better readability
-            • Explain important formulas or theories with context
-            • Show connections between different concepts
-            • Provide memory aids and learning tips
-            
-            EDUCATIONAL CONTENT:
-            {text}
-            
-            DETAILED EXPLANATION:
-            
-            ## Overview
-            [Brief introduction to the topic]
-            
-            ## Core Concepts
-            [Detailed explanation of main concepts]
-        
-            
-            ## Practical Examples
-            [Clear examples from everyday life]
-            
-            ## Connections & Relationships
-            [How these concepts relate to each other]
-            
-            ## Learning Tips & Memory Aids
-            [Strategies for understanding and remembering]
-            
-            ## Practice Applications
-            [How to apply this knowledge]
-            
-            Explanation:
-            """
+        language = _normalize_language(language_preference)
+        text = self._prepare(text)
+        chunks = await self._split_to_budget(text)
+        if len(chunks) > 1:
+            # Explain each part on its own and keep them in document order
+            explanations = await self._map_chunks(
+                functools.partial(self._explain_part, fused=fused), chunks, language
+            )
+            if any(map(_is_fallback, explanations)):
+                return FALLBACK_EXPLANATION
+            return "\n\n".join(explanations)
         
         try:
-            # Generate explanation in the requested language
-            explanation = await self._generate_content(prompt)
+            explanation = await self._explain_part(text, language, fused)
             
-            logger.info(f"Content explained in {language_preference} successfully")
+            logger.info("Content explained in %s successfully", language_preference)
             return explanation
             
         except Exception as e:
-            logger.error(f"Failed to explain content: {e}")
+            logger.error("Failed to explain content: %s", e)
             raise
     
+    async def explain_content_stream(self, text: str, language_preference: str = 'english') -> AsyncIterator[str]:
+        """
+        Stream an explanation of the content as it is generated.
+        
+        Args:
+            text: The course content to explain
+            language_preference: Language for the explanation ('english', 'arabic', or 'both')
+            
+        Yields:
+            str: Pieces of the explanation in order
+        """
+        language = _normalize_language(language_preference)
+        text = self._prepare(text)
+        if language == 'both':
+            # The bilingual markers cannot be stripped mid-stream, so stream
+            # each language in turn using the same layout as explain_content
+            templates = [ARABIC_PROMPT_TMPL, ENGLISH_PROMPT_TMPL]
+        elif language == 'arabic':
+            templates = [ARABIC_PROMPT_TMPL]
+        else:
+            templates = [ENGLISH_PROMPT_TMPL]
+        
+        # Each language is streamed by its own request, so each gets the single-language cap
+        config = _output_config(EXPLANATION_MAX_OUTPUT_TOKENS, 'english')
+        for chunk_index, chunk in enumerate(await self._split_to_budget(text)):
+            if chunk_index:
+                yield "\n\n"
+            for index, template in enumerate(templates):
+                if index:
+                    yield "\n\n---\n\n"
+                async for piece in self._generate_content_stream(template % chunk, config):
+                    yield piece
+        logger.info("Content explanation streamed in %s successfully", language_preference)
+    
+    async def _split_bilingual(self, text: str, explanation: str) -> str:
+        """Format a marked bilingual explanation, generating each language separately if the markers are missing."""
+        match = _BILINGUAL_RE.search(explanation)
+        if match:
+            english, arabic = match.group(1).strip(), match.group(2).strip()
+        elif _is_fallback(explanation):
+            # The API is unavailable, so separate calls would fail the same way
+            return explanation
+        else:
+            logger.warning("Bilingual explanation markers missing, generating each language separately")
+            return await self._explain_separately(text)
+        return f"{arabic}\n\n---\n\n{english}"
+    
+    async def _explain_separately(self, text: str) -> str:
+        """Explain text in Arabic and in English with one request each, concurrently."""
+        config = _output_config(EXPLANATION_MAX_OUTPUT_TOKENS, 'english')
+        arabic, english = await asyncio.gather(
+            self._generate_for_text(text, 'explanation', 'arabic', ARABIC_PROMPT_TMPL % text, config),
+            self._generate_for_text(text, 'explanation', 'english', ENGLISH_PROMPT_TMPL % text, config)
+        )
+        return f"{arabic}\n\n---\n\n{english}"
+    
     async def generate_exercises(self, text: str, language_preference: str = 'english') -> List[Dict[str, str]]:
         """
         Generate educational exercises based on course content.
@@ -419,196 +1449,187 @@ The AI service is currently experiencing high demand and is temporarily overload
         Returns:
             List[Dict[str, str]]: List of exercises with questions and answers
         """
-        if not text or not text.strip():
-            raise ValueError("Input text cannot be empty")
-        
-        language_instruction = ""
-        if language_preference.lower() == 'arabic':
-            language_instruction = "يرجى كتابة التمارين والأسئلة والأجوبة باللغة العربية بشكل كامل."
-        elif language_preference.lower() == 'both':
-            language_instruction = "Please provide exercises in both English and Arabic languages."
-        else:
-            language_instruction = "Please write all exercises, questions, and answers in English."
-        
-        prompt = f"""
-        Create 5 comprehensive educational exercises based on the following course content.
-        {language_instruction}
-        The exercises should cover different skill levels and question types.
-        
-        IMPORTANT: You must format each exercise EXACTLY as shown below, with clear separators:
-        
-        === EXERCISE 1 ===
-        Question: [Write a clear, specific question here]
-        Answer: [Provide a detailed answer with explanations]
-        
-        === EXERCISE 2 ===
-        Question: [Write a clear, specific question here]
-        Answer: [Provide a detailed answer with explanations]
-        
-        === EXERCISE 3 ===
-        Question: [Write a clear, specific question here]
-        Answer: [Provide a detailed answer with explanations]
-        
-        === EXERCISE 4 ===
-        Question: [Write a clear, specific question here]
-        Answer: [Provide a detailed answer with explanations]
-        
-        === EXERCISE 5 ===
-        Question: [Write a clear, specific question here]
-        Answer: [Provide a detailed answer with explanations]
-        
-        EXERCISE REQUIREMENTS:
-        • Include variety: multiple choice, short answer, problem-solving, application questions
-        • Progress from basic understanding to advanced application
-        • Provide detailed, educational answers with explanations
-        • Include step-by-step solutions where appropriate
-        • Add learning tips and common mistakes to avoid
-        • Make questions specific and clear, not generic
-        
-        COURSE CONTENT:
-        {text}
-        
-        Generate the exercises now:
-        """
+        # Over-budget texts are condensed to summaries first; exercises need one prompt
+        language = _normalize_language(language_preference)
+        text = await self._condense(self._prepare(text), language)
+        if text is None:
+            return self._parse_exercises(FALLBACK_EXERCISES)
+        prompt = EXERCISES_PROMPT_TMPL % (EXERCISES_LANGUAGE_INSTRUCTIONS[language], text)
         
         try:
-            exercises_text = await self._generate_content(prompt)
-            exercises = self._parse_exercises(exercises_text)
+            exercises_text = await self._generate_for_text(
+                text, 'exercises', language, prompt,
+                _output_config(EXERCISES_MAX_OUTPUT_TOKENS, language, EXERCISES_GENERATION_CONFIG)
+            )
+            exercises = self._load_exercises_json(exercises_text)
+            if exercises is None:
+                # Fallback text or a model that ignored the JSON response type
+                exercises = self._parse_exercises(exercises_text)
             
             if len(exercises) < 3:
-                logger.warning(f"Generated only {len(exercises)} exercises instead of 3")
+                logger.warning("Generated only %d exercises instead of 3", len(exercises))
             
-            logger.info(f"Generated {len(exercises)} exercises successfully")
+            logger.info("Generated %d exercises successfully", len(exercises))
             return exercises
             
         except Exception as e:
-            logger.error(f"Failed to generate exercises: {e}")
+            logger.error("Failed to generate exercises: %s", e)
             raise
     
-    def _parse_exercises(self, exercises_text: str) -> List[Dict[str, str]]:
+    async def batch_summarize(self, texts: List[str], language_preference: str = 'english',
+                              max_concurrency: Optional[int] = None) -> List[Any]:
         """
-        Parse the generated exercises text into structured format.
+        Summarize several texts with at most max_concurrency requests in flight.
         
         Args:
-            exercises_text: Raw text containing exercises
+            texts: The course contents to summarize
+            language_preference: Language for the summaries ('english', 'arabic', or 'both')
+            max_concurrency: Concurrent requests, defaulting to GEMINI_MAX_CONCURRENCY
             
         Returns:
-            List[Dict[str, str]]: Parsed exercises
+            List[Any]: A summary or the raised exception for each text, in input order
         """
-        import re
-        exercises = []
+        return await self._batch(self.summarize_content, texts, language_preference, max_concurrency)
+    
+    async def batch_explain(self, texts: List[str], language_preference: str = 'english',
+                            max_concurrency: Optional[int] = None) -> List[Any]:
+        """Explain several texts concurrently; see batch_summarize."""
+        return await self._batch(self.explain_content, texts, language_preference, max_concurrency)
+    
+    async def batch_generate_exercises(self, texts: List[str], language_preference: str = 'english',
+                                       max_concurrency: Optional[int] = None) -> List[Any]:
+        """Generate exercises for several texts concurrently; see batch_summarize."""
+        return await self._batch(self.generate_exercises, texts, language_preference, max_concurrency)
+    
+    async def _batch(self, method: Callable[[str, str], Awaitable[Any]], texts: List[str],
+                     language_preference: str, max_concurrency: Optional[int]) -> List[Any]:
+        """Run method over texts behind a semaphore, returning exceptions instead of raising them."""
+        # More concurrency than the executor has threads would only queue inside it
+        semaphore = asyncio.Semaphore(max_concurrency or self.config.GEMINI_MAX_CONCURRENCY)
         
-        # Try to split by the new format first
-        exercise_pattern = r'=== EXERCISE \d+ ==='
-        exercise_blocks = re.split(exercise_pattern, exercises_text)[1:]  # Skip first empty part
+        async def run(text: str) -> Any:
+            async with semaphore:
+                return await method(text, language_preference)
         
-        for i, block in enumerate(exercise_blocks, 1):
-            try:
-                # Look for Question and Answer patterns in the new format
-                question_match = re.search(r'Question:\s*(.*?)(?=Answer:|$)', block, re.DOTALL)
-                answer_match = re.search(r'Answer:\s*(.*?)(?=\n*$)', block, re.DOTALL)
-                
-                if question_match and answer_match:
-                    question = question_match.group(1).strip()
-                    answer = answer_match.group(1).strip()
-                    
-                    # Clean up formatting
-                    question = re.sub(r'\n+', ' ', question).strip()
-                    answer = re.sub(r'\n+', '\n', answer).strip()
-                    
-                    exercises.append({
-                        "question": question,
-                        "answer": answer,
-                        "type": f"Exercise {i}",
-                        "difficulty": self._determine_difficulty(i)
-                    })
-                    
-            except Exception as e:
-                logger.warning(f"Failed to parse exercise {i}: {e}")
-                continue
+        return await asyncio.gather(*(run(text) for text in texts), return_exceptions=True)
+    
+    async def generate_exercises_stream(self, text: str,
+                                        language_preference: str = 'english') -> AsyncIterator[Dict[str, str]]:
+        """
+        Stream exercises, yielding each one as soon as Gemini has finished writing it.
         
-        # Fallback: try old Exercise pattern
-        if not exercises:
-            exercise_pattern = r'Exercise \d+:'
-            exercise_blocks = re.split(exercise_pattern, exercises_text)[1:]  # Skip first empty part
+        Args:
+            text: The course content to create exercises from
+            language_preference: Language for the exercises ('english', 'arabic', or 'both')
             
-            for i, block in enumerate(exercise_blocks, 1):
+        Yields:
+            Dict[str, str]: Exercises with questions and answers, in order
+        """
+        language = _normalize_language(language_preference)
+        text = await self._condense(self._prepare(text), language)
+        if text is None:
+            for exercise in self._parse_exercises(FALLBACK_EXERCISES):
+                yield exercise
+            return
+        prompt = EXERCISES_PROMPT_TMPL % (EXERCISES_LANGUAGE_INSTRUCTIONS[language], text)
+        
+        scanner = JsonObjectScanner()
+        received = []
+        count = 0
+        config = _output_config(EXERCISES_MAX_OUTPUT_TOKENS, language, EXERCISES_GENERATION_CONFIG)
+        async for piece in self._generate_content_stream(prompt, config):
+            received.append(piece)
+            for raw in scanner.feed(piece):
                 try:
-                    # Look for Question and Answer patterns
-                    question_match = re.search(r'Question:\s*(.*?)(?=Answer:|$)', block, re.DOTALL)
-                    answer_match = re.search(r'Answer:\s*(.*?)(?=Exercise \d+:|$)', block, re.DOTALL)
-                    
-                    if question_match:
-                        question = question_match.group(1).strip()
-                        # Clean up question formatting
-                        question = re.sub(r'\n+', ' ', question)
-                        question = re.sub(r'^\s*Type:.*?\n', '', question, flags=re.MULTILINE)
-                        question = question.strip()
-                    else:
-                        # Fallback: use first few lines as question
-                        lines = [line.strip() for line in block.split('\n') if line.strip()]
-                        question = ' '.join(lines[:2]) if lines else f"Exercise {i} - Please review the content"
-                    
-                    if answer_match:
-                        answer = answer_match.group(1).strip()
-                        # Clean up answer formatting
-                        answer = re.sub(r'\n+', '\n', answer)
-                        answer = answer.strip()
-                    else:
-                        # Fallback: use remaining content as answer
-                        lines = [line.strip() for line in block.split('\n') if line.strip()]
-                        answer = '\n'.join(lines[2:]) if len(lines) > 2 else "Please refer to the course material for the answer."
-                    
-                    if question and answer and len(question) > 10:
-                        exercises.append({
-                            "question": question,
-                            "answer": answer,
-                            "type": f"Exercise {i}",
-                            "difficulty": self._determine_difficulty(i)
-                        })
-                        
-                except Exception as e:
-                    logger.warning(f"Failed to parse exercise {i}: {e}")
+                    item = orjson.loads(raw)
+                except ValueError:
                     continue
+                exercise = self._exercise_from_json(item, count + 1)
+                if exercise is not None and count < 5:
+                    count += 1
+                    yield exercise
+        
+        if not count:
+            # Fallback text or a model that ignored the JSON response type
+            for exercise in self._parse_exercises(''.join(received)):
+                yield exercise
+        logger.info("Exercises streamed successfully")
+    
+    def _load_exercises_json(self, exercises_text: str) -> Optional[List[Dict[str, str]]]:
+        """Load a JSON exercise array, or return None if the text is not one."""
+        try:
+            items = orjson.loads(exercises_text)
+        except ValueError:
+            return None
+        if not isinstance(items, list):
+            return None
+        
+        exercises = []
+        for item in items:
+            exercise = self._exercise_from_json(item, len(exercises) + 1)
+            if exercise is not None:
+                exercises.append(exercise)
+        return exercises[:5] or None
+    
+    def _exercise_from_json(self, item: Any, number: int) -> Optional[Dict[str, str]]:
+        """Build exercise number from one decoded JSON object, or None if it lacks a question or answer."""
+        if not isinstance(item, dict) or not item.get("question") or not item.get("answer"):
+            return None
+        return {
+            "question": str(item["question"]).strip(),
+            "answer": str(item["answer"]).strip(),
+            "type": f"Exercise {number}",
+            "difficulty": self._determine_difficulty(number)
+        }
+    
+    def _parse_exercises(self, exercises_text: str) -> List[Dict[str, str]]:
+        """
+        Parse the generated exercises text into structured format.
+        
+        Args:
+            exercises_text: Raw text containing exercises
+            
+        Returns:
+            List[Dict[str, str]]: Parsed exercises
+        """
+        exercises = [
+            {
+                "question": question,
+                "answer": answer,
+                "type": f"Exercise {i}",
+                "difficulty": self._determine_difficulty(i)
+            }
+            for i, (question, answer) in enumerate(self._iter_exercise_blocks(exercises_text), 1)
+        ]
         
         # Enhanced fallback: only if no exercises were parsed at all
         if not exercises and exercises_text and len(exercises_text.strip()) > 50:
             logger.warning("Failed to parse exercises, creating fallback exercises")
-            # Try to extract any questions from the raw text
-            question_patterns = [
-                r'Question:\s*(.*?)(?=Answer:|$)',
-                r'\?\s*\n',  # Look for question marks
-                r'قارن|اشرح|ما هو|كيف|لماذا',  # Arabic question words
-                r'Compare|Explain|What is|How|Why'  # English question words
-            ]
-            
-            # Split text into sentences and look for questions
-            sentences = re.split(r'[.!?]\s+', exercises_text)
+            # Find the sentence boundaries once; questions and answers are sliced from them
+            bounds = [0] + [m.end() for m in _SENTENCE_SPLIT_RE.finditer(exercises_text)] + [len(exercises_text)]
+            sentences = list(zip(bounds, bounds[1:]))
             potential_exercises = []
             
-            for sentence in sentences:
-                if len(sentence.strip()) > 20:
-                    # Check if this looks like a question
-                    is_question = (
-                        '?' in sentence or 
-                        any(re.search(pattern, sentence, re.IGNORECASE) for pattern in question_patterns)
-                    )
-                    
-                    if is_question:
-                        # This sentence might be a question, try to find its answer
-                        question = sentence.strip()
-                        # Look for content after this sentence as potential answer
-                        remaining_text = exercises_text[exercises_text.find(sentence) + len(sentence):].strip()
-                        answer_part = remaining_text.split('.')[0:3]  # Take next 3 sentences
-                        answer = '. '.join(answer_part).strip()
-                        
-                        if len(answer) > 20:
-                            potential_exercises.append({
-                                "question": question,
-                                "answer": answer,
-                                "type": f"Exercise {len(potential_exercises) + 1}",
-                                "difficulty": "Medium"
-                            })
+            for index, (start, end) in enumerate(sentences):
+                sentence = exercises_text[start:end].strip()
+                if len(sentence) <= 20:
+                    continue
+                # Check if this looks like a question
+                if '?' not in sentence and _QUESTION_HINT_RE.search(sentence) is None:
+                    continue
+                
+                # The next three sentences are taken as its answer
+                following = sentences[index + 1:index + 4]
+                answer = exercises_text[following[0][0]:following[-1][1]].strip() if following else ""
+                if len(answer) > 20:
+                    potential_exercises.append({
+                        "question": sentence,
+                        "answer": answer,
+                        "type": f"Exercise {len(potential_exercises) + 1}",
+                        "difficulty": "Medium"
+                    })
+                    if len(potential_exercises) == 3:
+                        break
             
             # If we found potential exercises, use them
             if potential_exercises:
@@ -637,6 +1658,22 @@ The AI service is currently experiencing high demand and is temporarily overload
         
         return exercises[:5]  # Limit to 5 exercises
     
+    @staticmethod
+    def _iter_exercise_blocks(exercises_text: str) -> Iterator[Tuple[str, str]]:
+        """Yield (question, answer) pairs from the 'Exercise N' blocks in exercises_text."""
+        headers = list(_EXERCISE_HEADER_RE.finditer(exercises_text))
+        # Each block runs from the end of its header to the start of the next one,
+        # so the lazy question match never scans past its own block
+        ends = [header.start() for header in headers[1:]] + [len(exercises_text)]
+        for header, end in zip(headers, ends):
+            match = _EXERCISE_BODY_RE.match(exercises_text, header.end(), end)
+            if match is None:
+                continue
+            question = _LINE_BREAKS_RE.sub(' ', match['question'].strip())
+            answer = _LINE_BREAKS_RE.sub('\n', match['answer'].strip())
+            if question and answer:
+                yield question, answer
+    
     def _determine_difficulty(self, exercise_number: int) -> str:
         """Determine difficulty based on exercise number."""
         if exercise_number <= 2:
@@ -647,17 +1684,40 @@ The AI service is currently experiencing high demand and is temporarily overload
             return "Advanced"
     
     def _split_into_chunks(self, text: str, num_chunks: int) -> List[str]:
-        """Split text into approximately equal chunks."""
-        words = text.split()
-        chunk_size = max(1, len(words) // num_chunks)
+        """Split text into approximately equal chunks, breaking only at whitespace."""
+        target = max(1, len(text) // max(1, num_chunks))
         chunks = []
+        start = 0
         
-        for i in range(0, len(words), chunk_size):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk.strip():
+        while start < len(text):
+            end = start + target
+            if end < len(text):
+                # Move the cut forward to the next whitespace so no word is split
+                boundary = _WHITESPACE_RE.search(text, end)
+                end = boundary.start() if boundary else len(text)
+            chunk = text[start:end].strip()
+            if chunk:
                 chunks.append(chunk)
+            start = end + 1
         
         return chunks
 
-# Global Gemini service instance
-gemini_service = GeminiService()
+# Global Gemini service instance, created on first use so importing this module
+# does not configure the SDK or build a model
+_service: Optional[GeminiService] = None
+_service_lock = threading.Lock()
+
+def get_gemini_service() -> GeminiService:
+    """Return the shared Gemini service, creating it on first call."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = GeminiService()
+    return _service
+
+def __getattr__(name: str) -> Any:
+    """Resolve the legacy `gemini_service` attribute lazily (PEP 562)."""
+    if name == 'gemini_service':
+        return get_gemini_service()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
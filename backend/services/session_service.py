@@ -6,8 +6,7 @@ Handles learning session CRUD operations and AI integration
 from typing import Optional, Dict, Any, List
 from flask import current_app
 from db.database import DatabaseService
-from services.gemini_service import GeminiService
-import json
+from services.gemini_service import GeminiService, get_gemini_service
 
 
 class SessionService:
@@ -15,7 +14,11 @@ class SessionService:
     
     def __init__(self):
         self.db = DatabaseService()
-        self.gemini = GeminiService()
+    
+    @property
+    def gemini(self) -> GeminiService:
+        """The shared Gemini service, so sessions use the same caches and limits as the API routes"""
+        return get_gemini_service()
     
     async def create_summary_session(self, user_id: int, text: str, language: str = "english") -> Dict[str, Any]:
         """Create a new summary session"""
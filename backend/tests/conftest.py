@@ -0,0 +1,9 @@
+import asyncio
+import pytest
+
+@pytest.fixture(scope="session")
+def event_loop():
+    """Share one event loop across all async tests in the session."""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
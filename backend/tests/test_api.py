@@ -1,12 +1,26 @@
 import pytest
 import asyncio
 import json
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
 from unittest.mock import Mock, patch, AsyncMock
 from flask import Flask
 from app import create_app
-from services.gemini_service import GeminiService
+from google.api_core.exceptions import DeadlineExceeded
+from services.gemini_service import (
+    FALLBACK_SUMMARY, REQUEST_TIMEOUT_SECONDS, CircuitBreaker, ConcurrencyLimiter, GeminiService,
+    RateLimiter, ResponseCache, SemanticCache
+)
 from db.database import DatabaseService
 
+# Read-only so code under test cannot mutate the shared mock data
+_FROZEN_EXERCISES = tuple(MappingProxyType(exercise) for exercise in [
+    {"question": "What is Python?", "answer": "Python is a programming language"},
+    {"question": "What is Flask?", "answer": "Flask is a web framework"},
+    {"question": "What is API?", "answer": "API stands for Application Programming Interface"}
+])
+
 @pytest.fixture
 def app():
     """Create and configure a test Flask app."""
@@ -28,6 +42,49 @@ def runner(app):
     """Create a test runner."""
     return app.test_cli_runner()
 
+@pytest.fixture
+def mock_gemini():
+    """Patch the Gemini calls made by the content endpoints."""
+    with patch('services.gemini_service.gemini_service.summarize_content', new_callable=AsyncMock) as summarize, \
+         patch('services.gemini_service.gemini_service.explain_content', new_callable=AsyncMock) as explain, \
+         patch('services.gemini_service.gemini_service.generate_exercises', new_callable=AsyncMock) as generate:
+        yield Mock(summarize_content=summarize, explain_content=explain, generate_exercises=generate)
+
+@pytest.fixture
+def mock_db_session():
+    """Patch session persistence so content endpoints never reach the database."""
+    stored = {'success': True, 'session': {'id': 1}}
+    with patch('services.session_service.session_service.create_summary_session', new_callable=AsyncMock, return_value=stored), \
+         patch('services.session_service.session_service.create_explanation_session', new_callable=AsyncMock, return_value=stored), \
+         patch('services.session_service.session_service.create_exercises_session', new_callable=AsyncMock, return_value=stored):
+        yield
+
+@dataclass(frozen=True)
+class BadRequestCase:
+    """Hashable request carrier; payload is a tuple of (key, value) items."""
+    path: str
+    payload: tuple = ()
+
+class TestRequiredTextField:
+    """Test the required text field on the content endpoints."""
+    
+    @pytest.mark.parametrize("case", [
+        BadRequestCase('/api/summarize', (('other', 'x'),)),
+        BadRequestCase('/api/summarize', (('text', ''),)),
+        BadRequestCase('/api/explain', (('other', 'x'),)),
+        BadRequestCase('/api/generate_exercises', (('other', 'x'),)),
+    ], ids=['summarize-missing', 'summarize-empty', 'explain-missing', 'exercises-missing'])
+    def test_text_required(self, client, case):
+        """Test that a missing or empty text field is rejected."""
+        response = client.post(case.path, 
+                             json=dict(case.payload),
+                             content_type='application/json')
+        
+        assert response.status_code == 400
+        data = json.loads(response.data)
+        assert 'error' in data
+        assert 'text' in data['error']
+
 class TestHealthEndpoint:
     """Test health check endpoints."""
     
@@ -50,42 +107,46 @@ class TestHealthEndpoint:
 class TestSummarizeEndpoint:
     """Test the summarize endpoint."""
     
-    @patch('services.gemini_service.gemini_service.summarize_content')
-    def test_summarize_success(self, mock_summarize, client):
-        """Test successful content summarization."""
-        # Mock the Gemini service
-        mock_summarize.return_value = asyncio.create_task(
-            asyncio.coroutine(lambda: "This is a test summary")()
-        )
+    @pytest.mark.parametrize("user_id", [None, 1], ids=["anonymous", "with-user-id"])
+    def test_summarize(self, mock_gemini, mock_db_session, client, user_id):
+        """Test successful content summarization, with and without user_id."""
+        mock_gemini.summarize_content.return_value = "This is a test summary"
+        payload = {'text': 'Test content to summarize'}
+        if user_id is not None:
+            payload['user_id'] = user_id
         
         response = client.post('/api/summarize', 
-                             json={'text': 'Test content to summarize'},
+                             json=payload,
                              content_type='application/json')
         
         assert response.status_code == 200
         data = json.loads(response.data)
         assert 'summary' in data
 
-    def test_summarize_missing_text(self, client):
-        """Test summarize with missing text field."""
-        response = client.post('/api/summarize', 
-                             json={},
-                             content_type='application/json')
+    def test_summarize_stream(self, client):
+        """Test that the streaming endpoint sends the summary pieces in order."""
+        async def pieces(text, language_preference):
+            for piece in ("Part one. ", "Part two."):
+                yield piece
         
-        assert response.status_code == 400
-        data = json.loads(response.data)
-        assert 'error' in data
-        assert 'text' in data['error']
+        with patch('services.gemini_service.gemini_service.summarize_content_stream', pieces):
+            response = client.post('/api/summarize/stream', json={'text': 'Test content to summarize'})
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        assert response.get_data(as_text=True) == "Part one. Part two."
 
-    def test_summarize_empty_text(self, client):
-        """Test summarize with empty text."""
-        response = client.post('/api/summarize', 
-                             json={'text': ''},
-                             content_type='application/json')
+    def test_summarize_stream_error_before_first_piece(self, client):
+        """Test that a failure before anything was streamed returns a JSON error status."""
+        async def pieces(text, language_preference):
+            raise ValueError("Input text cannot be empty")
+            yield
+        
+        with patch('services.gemini_service.gemini_service.summarize_content_stream', pieces):
+            response = client.post('/api/summarize/stream', json={'text': 'Test content to summarize'})
         
         assert response.status_code == 400
-        data = json.loads(response.data)
-        assert 'error' in data
+        assert json.loads(response.data)['error'] == 'Invalid input'
 
     def test_summarize_invalid_json(self, client):
         """Test summarize with invalid JSON."""
@@ -105,72 +166,48 @@ class TestSummarizeEndpoint:
 class TestExplainEndpoint:
     """Test the explain endpoint."""
     
-    @patch('services.gemini_service.gemini_service.explain_content')
-    def test_explain_success(self, mock_explain, client):
-        """Test successful content explanation."""
-        # Mock the Gemini service
-        mock_explain.return_value = asyncio.create_task(
-            asyncio.coroutine(lambda: ("Arabic explanation", "English explanation"))()
-        )
+    @pytest.mark.parametrize("user_id", [None, 1], ids=["anonymous", "with-user-id"])
+    def test_explain(self, mock_gemini, mock_db_session, client, user_id):
+        """Test successful content explanation, with and without user_id."""
+        mock_gemini.explain_content.return_value = "English explanation"
+        payload = {'text': 'Test content to explain'}
+        if user_id is not None:
+            payload['user_id'] = user_id
         
         response = client.post('/api/explain', 
-                             json={'text': 'Test content to explain'},
+                             json=payload,
                              content_type='application/json')
         
         assert response.status_code == 200
         data = json.loads(response.data)
-        assert 'arabic_explanation' in data
-        assert 'english_explanation' in data
+        assert 'explanation' in data
 
-    def test_explain_missing_text(self, client):
-        """Test explain with missing text field."""
-        response = client.post('/api/explain', 
-                             json={},
-                             content_type='application/json')
+    def test_explain_stream(self, client):
+        """Test that the streaming endpoint sends the explanation pieces in order."""
+        async def pieces(text, language_preference):
+            for piece in ("Step one. ", "Step two."):
+                yield piece
         
-        assert response.status_code == 400
-        data = json.loads(response.data)
-        assert 'error' in data
-
-    def test_explain_with_user_id(self, client):
-        """Test explain with user_id."""
-        with patch('services.gemini_service.gemini_service.explain_content') as mock_explain, \
-             patch('db.database.db_service.create_session') as mock_create_session:
-            
-            mock_explain.return_value = asyncio.create_task(
-                asyncio.coroutine(lambda: ("Arabic explanation", "English explanation"))()
-            )
-            mock_create_session.return_value = asyncio.create_task(
-                asyncio.coroutine(lambda: {'id': 1})()
-            )
-            
-            response = client.post('/api/explain', 
-                                 json={'text': 'Test content', 'user_id': 1},
-                                 content_type='application/json')
-            
-            assert response.status_code == 200
-            data = json.loads(response.data)
-            assert 'arabic_explanation' in data
-            assert 'english_explanation' in data
+        with patch('services.gemini_service.gemini_service.explain_content_stream', pieces):
+            response = client.post('/api/explain/stream', json={'text': 'Test content to explain'})
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'text/plain'
+        assert response.get_data(as_text=True) == "Step one. Step two."
 
 class TestGenerateExercisesEndpoint:
     """Test the generate_exercises endpoint."""
     
-    @patch('services.gemini_service.gemini_service.generate_exercises')
-    def test_generate_exercises_success(self, mock_generate, client):
-        """Test successful exercise generation."""
-        # Mock the Gemini service
-        mock_exercises = [
-            {"question": "What is Python?", "answer": "Python is a programming language"},
-            {"question": "What is Flask?", "answer": "Flask is a web framework"},
-            {"question": "What is API?", "answer": "API stands for Application Programming Interface"}
-        ]
-        mock_generate.return_value = asyncio.create_task(
-            asyncio.coroutine(lambda: mock_exercises)()
-        )
+    @pytest.mark.parametrize("user_id", [None, 1], ids=["anonymous", "with-user-id"])
+    def test_generate_exercises(self, mock_gemini, mock_db_session, client, user_id):
+        """Test successful exercise generation, with and without user_id."""
+        mock_gemini.generate_exercises.return_value = [dict(exercise) for exercise in _FROZEN_EXERCISES]
+        payload = {'text': 'Test content for exercises'}
+        if user_id is not None:
+            payload['user_id'] = user_id
         
         response = client.post('/api/generate_exercises', 
-                             json={'text': 'Test content for exercises'},
+                             json=payload,
                              content_type='application/json')
         
         assert response.status_code == 200
@@ -180,35 +217,49 @@ class TestGenerateExercisesEndpoint:
         assert all('question' in exercise and 'answer' in exercise 
                   for exercise in data['exercises'])
 
-    def test_generate_exercises_missing_text(self, client):
-        """Test generate_exercises with missing text field."""
-        response = client.post('/api/generate_exercises', 
-                             json={},
-                             content_type='application/json')
+    def test_generate_exercises_stream(self, client):
+        """Test that the streaming endpoint sends one JSON exercise per line."""
+        async def exercises(text, language_preference):
+            for exercise in _FROZEN_EXERCISES[:2]:
+                yield dict(exercise)
         
-        assert response.status_code == 400
-        data = json.loads(response.data)
-        assert 'error' in data
+        with patch('services.gemini_service.gemini_service.generate_exercises_stream', exercises):
+            response = client.post('/api/generate_exercises/stream', json={'text': 'Test content for exercises'})
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = response.get_data(as_text=True).splitlines()
+        assert [json.loads(line) for line in lines] == [dict(exercise) for exercise in _FROZEN_EXERCISES[:2]]
+
+    def test_generate_exercises_stream_reports_a_failure_part_way(self, client):
+        """Test that a failure after the first exercise ends the stream with an error record."""
+        async def exercises(text, language_preference):
+            yield dict(_FROZEN_EXERCISES[0])
+            raise Exception("AI service error")
+        
+        with patch('services.gemini_service.gemini_service.generate_exercises_stream', exercises):
+            response = client.post('/api/generate_exercises/stream', json={'text': 'Test content for exercises'})
+            lines = response.get_data(as_text=True).splitlines()
+        
+        assert response.status_code == 200
+        assert json.loads(lines[0]) == dict(_FROZEN_EXERCISES[0])
+        assert json.loads(lines[-1]) == {'error': 'Failed to generate exercises', 'message': 'AI service error'}
 
 class TestUserEndpoints:
     """Test user management endpoints."""
     
-    @patch('db.database.db_service.get_user_by_email')
-    @patch('db.database.db_service.create_user')
+    @patch('db.database.db_service.get_user_by_email', new_callable=AsyncMock)
+    @patch('db.database.db_service.create_user', new_callable=AsyncMock)
     def test_create_user_success(self, mock_create_user, mock_get_user, client):
         """Test successful user creation."""
         # Mock database responses
-        mock_get_user.return_value = asyncio.create_task(
-            asyncio.coroutine(lambda: None)()  # User doesn't exist
-        )
-        mock_create_user.return_value = asyncio.create_task(
-            asyncio.coroutine(lambda: {
-                'id': 1,
-                'name': 'Test User',
-                'email': 'test@example.com',
-                'languagePref': 'english'
-            })()
-        )
+        mock_get_user.return_value = None  # User doesn't exist
+        mock_create_user.return_value = {
+            'id': 1,
+            'name': 'Test User',
+            'email': 'test@example.com',
+            'languagePref': 'english'
+        }
         
         response = client.post('/api/users', 
                              json={
@@ -223,13 +274,11 @@ class TestUserEndpoints:
         assert 'user' in data
         assert data['user']['email'] == 'test@example.com'
 
-    @patch('db.database.db_service.get_user_by_email')
+    @patch('db.database.db_service.get_user_by_email', new_callable=AsyncMock)
     def test_create_user_already_exists(self, mock_get_user, client):
         """Test creating user that already exists."""
         # Mock user already exists
-        mock_get_user.return_value = asyncio.create_task(
-            asyncio.coroutine(lambda: {'id': 1, 'email': 'test@example.com'})()
-        )
+        mock_get_user.return_value = {'id': 1, 'email': 'test@example.com'}
         
         response = client.post('/api/users', 
                              json={
@@ -254,24 +303,20 @@ class TestUserEndpoints:
         assert 'error' in data
         assert 'email' in data['error']
 
-    @patch('db.database.db_service.get_user_by_email')
-    @patch('db.database.db_service.get_user_sessions')
+    @patch('db.database.db_service.get_user_by_email', new_callable=AsyncMock)
+    @patch('db.database.db_service.get_user_sessions', new_callable=AsyncMock)
     def test_get_user_sessions_success(self, mock_get_sessions, mock_get_user, client):
         """Test getting user sessions successfully."""
         # Mock database responses
-        mock_get_user.return_value = asyncio.create_task(
-            asyncio.coroutine(lambda: {'id': 1, 'email': 'test@example.com'})()
-        )
-        mock_get_sessions.return_value = asyncio.create_task(
-            asyncio.coroutine(lambda: [
-                {
-                    'id': 1,
-                    'inputText': 'Test input',
-                    'outputSummary': 'Test summary',
-                    'createdAt': '2023-01-01T00:00:00Z'
-                }
-            ])()
-        )
+        mock_get_user.return_value = {'id': 1, 'email': 'test@example.com'}
+        mock_get_sessions.return_value = [
+            {
+                'id': 1,
+                'inputText': 'Test input',
+                'outputSummary': 'Test summary',
+                'createdAt': '2023-01-01T00:00:00Z'
+            }
+        ]
         
         response = client.get('/api/users/test@example.com/sessions')
         
@@ -280,12 +325,10 @@ class TestUserEndpoints:
         assert 'sessions' in data
         assert len(data['sessions']) == 1
 
-    @patch('db.database.db_service.get_user_by_email')
+    @patch('db.database.db_service.get_user_by_email', new_callable=AsyncMock)
     def test_get_user_sessions_user_not_found(self, mock_get_user, client):
         """Test getting sessions for non-existent user."""
-        mock_get_user.return_value = asyncio.create_task(
-            asyncio.coroutine(lambda: None)()
-        )
+        mock_get_user.return_value = None
         
         response = client.get('/api/users/nonexistent@example.com/sessions')
         
@@ -311,6 +354,21 @@ class TestErrorHandling:
         data = json.loads(response.data)
         assert 'error' in data
 
+@pytest.fixture(scope="module")
+def gemini_service_instance():
+    """Build one GeminiService with the SDK patched, shared by the module."""
+    with patch('google.generativeai.configure'), \
+         patch('google.generativeai.GenerativeModel') as mock_model:
+        mock_model.return_value = Mock()
+        yield GeminiService()
+
+@pytest.fixture
+def mock_generate(gemini_service_instance, monkeypatch):
+    """Replace _generate_content on the shared service for a single test."""
+    mock = AsyncMock()
+    monkeypatch.setattr(gemini_service_instance, '_generate_content', mock)
+    return mock
+
 class TestGeminiService:
     """Test Gemini service functionality."""
     
@@ -326,42 +384,88 @@ class TestGeminiService:
         mock_configure.assert_called_once()
         mock_model.assert_called_once()
 
-    @patch('services.gemini_service.GeminiService._generate_content')
     @pytest.mark.asyncio
-    async def test_summarize_content(self, mock_generate):
+    async def test_summarize_content(self, gemini_service_instance, mock_generate):
         """Test content summarization."""
         mock_generate.return_value = "Test summary"
         
-        service = GeminiService()
-        result = await service.summarize_content("Test content")
+        result = await gemini_service_instance.summarize_content("Test content")
         
         assert result == "Test summary"
         mock_generate.assert_called_once()
 
     @pytest.mark.asyncio
-    async def test_summarize_empty_content(self):
+    async def test_summarize_empty_content(self, gemini_service_instance):
         """Test summarization with empty content."""
-        service = GeminiService()
-        
         with pytest.raises(ValueError):
-            await service.summarize_content("")
+            await gemini_service_instance.summarize_content("")
+
+    @pytest.mark.asyncio
+    async def test_text_that_cleans_up_to_nothing_is_rejected(self, gemini_service_instance, mock_generate):
+        """Test that text of only zero-width characters and line breaks counts as empty."""
+        with pytest.raises(ValueError):
+            await gemini_service_instance.explain_content("\u200b\r\n\f")
+        with pytest.raises(ValueError):
+            [exercise async for exercise in gemini_service_instance.generate_exercises_stream("\ufeff\r")]
+        mock_generate.assert_not_called()
 
-    @patch('services.gemini_service.GeminiService._generate_content')
     @pytest.mark.asyncio
-    async def test_explain_content(self, mock_generate):
+    async def test_explain_content(self, gemini_service_instance, mock_generate):
         """Test content explanation."""
-        mock_generate.side_effect = ["Arabic explanation", "English explanation"]
+        mock_generate.return_value = "English explanation"
         
-        service = GeminiService()
-        arabic, english = await service.explain_content("Test content")
+        explanation = await gemini_service_instance.explain_content("Test content")
+        
+        assert explanation == "English explanation"
+        mock_generate.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_explain_content_both_languages(self, gemini_service_instance, mock_generate):
+        """Test that a bilingual explanation is produced by a single call."""
+        mock_generate.return_value = "<<<EN>>>\nEnglish explanation\n<<<END_EN>>>\n<<<AR>>>\nشرح بالعربية\n<<<END_AR>>>"
+        
+        explanation = await gemini_service_instance.explain_content("Test content", 'both')
+        
+        assert explanation == "شرح بالعربية\n\n---\n\nEnglish explanation"
+        mock_generate.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_explain_content_both_languages_without_markers(self, gemini_service_instance, mock_generate):
+        """Test that unmarked bilingual output falls back to one call per language."""
+        mock_generate.side_effect = ["Unmarked explanation", "شرح بالعربية", "English explanation"]
+        
+        explanation = await gemini_service_instance.explain_content("Test content", 'both')
+        
+        assert explanation == "شرح بالعربية\n\n---\n\nEnglish explanation"
+        assert mock_generate.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_explain_content_both_languages_unfused(self, gemini_service_instance, mock_generate):
+        """Test that fused=False makes one call per language."""
+        mock_generate.side_effect = ["شرح بالعربية", "English explanation"]
+        
+        explanation = await gemini_service_instance.explain_content("Test content", 'both', fused=False)
         
-        assert arabic == "Arabic explanation"
-        assert english == "English explanation"
+        assert explanation == "شرح بالعربية\n\n---\n\nEnglish explanation"
         assert mock_generate.call_count == 2
 
-    @patch('services.gemini_service.GeminiService._generate_content')
     @pytest.mark.asyncio
-    async def test_generate_exercises(self, mock_generate):
+    async def test_long_text_unfused_explains_each_part_per_language(self, gemini_service_instance,
+                                                                     mock_generate, monkeypatch):
+        """Test that fused=False still makes one call per language for each part of a long text."""
+        model = Mock()
+        model.count_tokens.side_effect = lambda text: Mock(total_tokens=len(text) // 4)
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        monkeypatch.setattr(gemini_service_instance.config, 'GEMINI_MAX_INPUT_TOKENS', 1010)
+        mock_generate.side_effect = lambda prompt, config: "شرح" if prompt.startswith("\nاشرح") else "Explained"
+        
+        explanation = await gemini_service_instance.explain_content("word " * 20, 'both', fused=False)
+        
+        assert explanation == "\n\n".join(["شرح\n\n---\n\nExplained"] * 3)
+        assert mock_generate.call_count == 6
+
+    @pytest.mark.asyncio
+    async def test_generate_exercises(self, gemini_service_instance, mock_generate):
         """Test exercise generation."""
         mock_response = """
         Exercise 1:
@@ -378,11 +482,437 @@ class TestGeminiService:
         """
         mock_generate.return_value = mock_response
         
-        service = GeminiService()
-        exercises = await service.generate_exercises("Test content")
+        exercises = await gemini_service_instance.generate_exercises("Test content")
         
         assert len(exercises) == 3
         assert all('question' in ex and 'answer' in ex for ex in exercises)
 
+    @pytest.mark.asyncio
+    async def test_generate_exercises_json(self, gemini_service_instance, mock_generate):
+        """Test that exercises requested as JSON are loaded without text parsing."""
+        mock_generate.return_value = json.dumps([
+            {"question": "What is Python?", "answer": "A programming language."},
+            {"question": "What is Flask?", "answer": "A web framework."},
+        ])
+        
+        exercises = await gemini_service_instance.generate_exercises("Test content")
+        
+        assert [ex['question'] for ex in exercises] == ["What is Python?", "What is Flask?"]
+        assert exercises[1]['type'] == "Exercise 2"
+        assert mock_generate.call_args.args[1]['response_mime_type'] == "application/json"
+
+    def test_parse_exercises_separator_format(self, gemini_service_instance):
+        """Test parsing of the '=== EXERCISE N ===' format the prompt asks for."""
+        text = (
+            "=== EXERCISE 1 ===\nQuestion: What is Python?\nAnswer: A language.\n\n"
+            "=== EXERCISE 2 ===\nQuestion: What is\nFlask?\nAnswer: A web\n\nframework.\n"
+        )
+        
+        exercises = gemini_service_instance._parse_exercises(text)
+        
+        assert [ex['question'] for ex in exercises] == ["What is Python?", "What is Flask?"]
+        assert exercises[1]['answer'] == "A web\nframework."
+        assert exercises[0]['type'] == "Exercise 1"
+
+    @pytest.mark.asyncio
+    async def test_generate_content_is_cached(self, gemini_service_instance, monkeypatch):
+        """Test that an identical prompt is answered from the response cache."""
+        model = Mock()
+        model.generate_content.return_value = Mock(text="Cached summary")
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        gemini_service_instance.cache_clear()
+        
+        first = await gemini_service_instance._generate_content("Summarize this")
+        second = await gemini_service_instance._generate_content("Summarize this")
+        
+        assert first == second == "Cached summary"
+        model.generate_content.assert_called_once()
+        assert gemini_service_instance.cache.stats["hits"] >= 1
+
+    @pytest.mark.asyncio
+    async def test_disk_cache_outlives_memory_cache(self, gemini_service_instance, monkeypatch, tmp_path):
+        """Test that a response persisted to disk is served after the memory cache is lost."""
+        cache = ResponseCache(max_size=8, ttl_seconds=60, disk_path=str(tmp_path / "responses.db"),
+                              disk_ttl_seconds=60)
+        monkeypatch.setattr(gemini_service_instance, 'cache', cache)
+        model = Mock()
+        model.generate_content.return_value = Mock(text="Persisted summary")
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        gemini_service_instance.cache_clear()
+        
+        await gemini_service_instance._generate_content("Persist this")
+        cache._entries.clear()
+        second = await gemini_service_instance._generate_content("Persist this")
+        
+        assert second == "Persisted summary"
+        model.generate_content.assert_called_once()
+        cache.close()
+
+    def test_disk_cache_failure_does_not_break_clear(self, tmp_path):
+        """Test that clearing still empties the memory cache when the disk tier fails."""
+        cache = ResponseCache(max_size=8, ttl_seconds=60, disk_path=str(tmp_path / "responses.db"),
+                              disk_ttl_seconds=60)
+        cache.put(b"key", "Cached answer")
+        cache._disk.close()
+        
+        cache.clear()
+        
+        assert not cache._entries
+
+    def test_retry_after_is_read_from_the_api_error(self):
+        """Test that the Retry-After header of the underlying API error is honoured."""
+        api_error = Exception("503 overloaded")
+        api_error.response = Mock(headers={'Retry-After': '7'})
+        try:
+            raise Exception("The AI service is currently overloaded.") from api_error
+        except Exception as e:
+            wrapped = e
+        
+        assert GeminiService._retry_after(wrapped) == 7.0
+        assert GeminiService._retry_after(Exception("no cause")) is None
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limiter_bounds_callers(self):
+        """Test that no more callers than the limit hold a slot at once."""
+        limiter = ConcurrencyLimiter(2)
+        running = []
+        peak = []
+        
+        async def call():
+            async with limiter:
+                running.append(1)
+                peak.append(len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+        
+        await asyncio.gather(*[call() for _ in range(5)])
+        
+        assert max(peak) == 2
+
+    @pytest.mark.asyncio
+    async def test_rate_limiter_spaces_out_requests(self, monkeypatch):
+        """Test that requests beyond the bucket wait for the refill rate."""
+        sleeps = []
+        
+        async def fake_sleep(delay):
+            sleeps.append(delay)
+        
+        monkeypatch.setattr(asyncio, 'sleep', fake_sleep)
+        limiter = RateLimiter(requests_per_minute=60)
+        
+        await limiter.acquire()
+        await limiter.acquire()
+        
+        assert len(sleeps) == 1
+        assert sleeps[0] == pytest.approx(1.0, abs=0.05)
+
+    @pytest.mark.asyncio
+    async def test_rate_limiter_refunds_a_cancelled_wait(self):
+        """Test that a caller cancelled while waiting does not push back later callers."""
+        limiter = RateLimiter(requests_per_minute=60)
+        await limiter.acquire()
+        
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.acquire(), timeout=0.01)
+        
+        assert limiter._tokens > -0.5
+
+    def test_semantic_cache_matches_similar_text_for_same_task(self):
+        """Test that lookups honour the similarity threshold, task and language."""
+        cache = SemanticCache(threshold=0.9, max_size=8, ttl_seconds=60)
+        cache.add((1.0, 0.0), 'summary', 'english', "Cached summary")
+        
+        assert cache.lookup((0.96, 0.28), 'summary', 'english') == "Cached summary"
+        assert cache.lookup((0.6, 0.8), 'summary', 'english') is None
+        assert cache.lookup((1.0, 0.0), 'explanation', 'english') is None
+        assert cache.lookup((1.0, 0.0), 'summary', 'arabic') is None
+
+    @pytest.mark.asyncio
+    async def test_exact_repeat_skips_the_embedding(self, gemini_service_instance, mock_generate, monkeypatch):
+        """Test that an exact cache hit is served before the text is embedded for the semantic cache."""
+        embed = AsyncMock(return_value=(1.0, 0.0))
+        monkeypatch.setattr(gemini_service_instance, '_embed', embed)
+        monkeypatch.setattr(gemini_service_instance, 'semantic_cache',
+                            SemanticCache(threshold=0.9, max_size=8, ttl_seconds=60))
+        gemini_service_instance.cache_clear()
+        gemini_service_instance.cache.put(gemini_service_instance._cache_key("Prompt"), "Cached answer")
+        
+        result = await gemini_service_instance._generate_for_text("Text", 'summary', 'english', "Prompt")
+        
+        assert result == "Cached answer"
+        embed.assert_not_called()
+        mock_generate.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_semantic_cache_miss_is_counted_once(self, gemini_service_instance, monkeypatch):
+        """Test that a prompt missing both caches adds a single miss to the exact-cache stats."""
+        monkeypatch.setattr(gemini_service_instance, '_generate_content_with_retry', AsyncMock(return_value="Answer"))
+        monkeypatch.setattr(gemini_service_instance, '_embed', AsyncMock(return_value=(1.0, 0.0)))
+        monkeypatch.setattr(gemini_service_instance, 'semantic_cache',
+                            SemanticCache(threshold=0.9, max_size=8, ttl_seconds=60))
+        gemini_service_instance.cache_clear()
+        misses = gemini_service_instance.cache.stats["misses"]
+        
+        await gemini_service_instance._generate_for_text("Text", 'summary', 'english', "Prompt")
+        
+        assert gemini_service_instance.cache.stats["misses"] == misses + 1
+
+    @pytest.mark.asyncio
+    async def test_summarize_content_stream(self, gemini_service_instance, monkeypatch):
+        """Test that streamed chunks are yielded as the model produces them."""
+        model = Mock()
+        model.generate_content.return_value = iter([Mock(text="Hello "), Mock(text="world")])
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        
+        pieces = [piece async for piece in gemini_service_instance.summarize_content_stream("Test content")]
+        
+        assert pieces == ["Hello ", "world"]
+        assert model.generate_content.call_args.kwargs['stream'] is True
+        assert model.generate_content.call_args.kwargs['request_options'] == {'timeout': REQUEST_TIMEOUT_SECONDS}
+
+    @pytest.mark.asyncio
+    async def test_explain_content_stream_both_languages(self, gemini_service_instance, monkeypatch):
+        """Test that a bilingual stream sends Arabic, then a separator, then English."""
+        model = Mock()
+        model.generate_content.side_effect = [iter([Mock(text="شرح")]), iter([Mock(text="Explanation")])]
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        
+        pieces = [piece async for piece in gemini_service_instance.explain_content_stream("Test content", "both")]
+        
+        assert "".join(pieces) == "شرح\n\n---\n\nExplanation"
+
+    def test_dedupe_paragraphs(self, gemini_service_instance):
+        """Test that repeated paragraphs are sent once, in first-seen order."""
+        text = "Course header\n\nChapter 1\n\n\nCourse header\n\nChapter 2\n\nCourse header"
+        
+        assert gemini_service_instance._dedupe_paragraphs(text) == "Course header\n\nChapter 1\n\nChapter 2"
+
+    @pytest.mark.asyncio
+    async def test_batch_summarize_limits_concurrency(self, gemini_service_instance, monkeypatch):
+        """Test that a batch keeps input order, caps concurrency and returns failures in place."""
+        running = []
+        peak = []
+        
+        async def summarize(text, language_preference):
+            running.append(text)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(text)
+            if text == "bad":
+                raise ValueError("Input text cannot be empty")
+            return f"Summary of {text}"
+        
+        monkeypatch.setattr(gemini_service_instance, 'summarize_content', summarize)
+        
+        results = await gemini_service_instance.batch_summarize(["a", "bad", "c", "d"], max_concurrency=2)
+        
+        assert results[0] == "Summary of a"
+        assert isinstance(results[1], ValueError)
+        assert results[2:] == ["Summary of c", "Summary of d"]
+        assert max(peak) == 2
+
+    @pytest.mark.asyncio
+    async def test_long_text_is_summarized_in_parts(self, gemini_service_instance, mock_generate, monkeypatch):
+        """Test that text over the token budget is summarized per part, then summarized again."""
+        model = Mock()
+        model.count_tokens.side_effect = lambda text: Mock(total_tokens=len(text) // 4)
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        monkeypatch.setattr(gemini_service_instance.config, 'GEMINI_MAX_INPUT_TOKENS', 1010)
+        mock_generate.return_value = "short"
+        gemini_service_instance._token_counts.clear()
+        
+        summary = await gemini_service_instance.summarize_content("word " * 20)
+        
+        assert summary == "short"
+        assert mock_generate.call_count == 4
+        assert "short\n\nshort\n\nshort" in mock_generate.call_args.args[0]
+        # Once for the text and once for the joined summaries; the parts are not re-counted
+        assert model.count_tokens.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_failed_part_skips_the_reduce_step(self, gemini_service_instance, mock_generate, monkeypatch):
+        """Test that a part answered with the fallback text is not summarized again as course text."""
+        model = Mock()
+        model.count_tokens.side_effect = lambda text: Mock(total_tokens=len(text) // 4)
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        monkeypatch.setattr(gemini_service_instance.config, 'GEMINI_MAX_INPUT_TOKENS', 1010)
+        mock_generate.side_effect = ["short", FALLBACK_SUMMARY, "short"]
+        
+        summary = await gemini_service_instance.summarize_content("word " * 20)
+        
+        assert summary == FALLBACK_SUMMARY
+        assert mock_generate.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_token_counts_are_cached(self, gemini_service_instance, monkeypatch):
+        """Test that counting the same text twice makes one count_tokens call."""
+        model = Mock()
+        model.count_tokens.return_value = Mock(total_tokens=42)
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        
+        counts = [await gemini_service_instance._count_tokens("Repeated footer") for _ in range(2)]
+        
+        assert counts == [42, 42]
+        assert model.count_tokens.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_language_preference_is_case_insensitive(self, gemini_service_instance, mock_generate):
+        """Test that 'ARABIC' selects the Arabic prompt and unknown languages fall back to English."""
+        mock_generate.return_value = "شرح"
+        
+        await gemini_service_instance.explain_content("Test content", "ARABIC")
+        assert mock_generate.call_args.args[0].startswith("\nاشرح")
+        
+        await gemini_service_instance.explain_content("Test content", "klingon")
+        assert mock_generate.call_args.args[0].startswith("\nProvide a comprehensive")
+
+    @pytest.mark.asyncio
+    async def test_output_tokens_are_capped_per_task(self, gemini_service_instance, mock_generate):
+        """Test that each task sends its own reply cap and 'both' gets one per language."""
+        mock_generate.return_value = "Summary"
+
+        await gemini_service_instance.summarize_content("Test content", "english")
+        assert mock_generate.call_args.args[1]["max_output_tokens"] == 800
+
+        await gemini_service_instance.summarize_content("Test content", "both")
+        assert mock_generate.call_args.args[1]["max_output_tokens"] == 1600
+
+    @pytest.mark.asyncio
+    async def test_open_circuit_breaker_skips_the_api(self, gemini_service_instance, monkeypatch):
+        """Test that consecutive overload errors open the breaker and later calls fall back at once."""
+        internal = AsyncMock(side_effect=Exception("503 The model is overloaded"))
+        monkeypatch.setattr(gemini_service_instance, '_generate_content_internal', internal)
+        monkeypatch.setattr(gemini_service_instance, '_breaker', CircuitBreaker(threshold=3, cooldown_seconds=30))
+        monkeypatch.setattr(asyncio, 'sleep', AsyncMock())
+        
+        first = await gemini_service_instance._generate_content_with_retry("Explain this")
+        second = await gemini_service_instance._generate_content_with_retry("Explain this")
+        
+        assert first == second == gemini_service_instance._get_fallback_response("Explain this")
+        assert internal.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_sdk_deadline_exceeded_trips_the_breaker(self, gemini_service_instance, monkeypatch):
+        """Test that a transport deadline from the SDK counts as a timeout towards the breaker."""
+        model = Mock()
+        model.generate_content.side_effect = DeadlineExceeded("Deadline Exceeded")
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        monkeypatch.setattr(gemini_service_instance, '_breaker', CircuitBreaker(threshold=1, cooldown_seconds=30))
+        monkeypatch.setattr(asyncio, 'sleep', AsyncMock())
+        
+        result = await gemini_service_instance._generate_content_with_retry("Explain this")
+        
+        assert gemini_service_instance._breaker.is_open()
+        assert result == gemini_service_instance._get_fallback_response("Explain this")
+        model.generate_content.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_generate_exercises_stream_yields_each_completed_object(self, gemini_service_instance, monkeypatch):
+        """Test that exercises are yielded as soon as their JSON object closes, even across chunks."""
+        model = Mock()
+        model.generate_content.return_value = iter([
+            Mock(text='[{"question": "What is {x}?", "ans'),
+            Mock(text='wer": "A \\"brace\\" }"}, {"question": "Why?"'),
+            Mock(text=', "answer": "Because."}]'),
+        ])
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        
+        exercises = [ex async for ex in gemini_service_instance.generate_exercises_stream("Test content")]
+        
+        assert [ex['question'] for ex in exercises] == ["What is {x}?", "Why?"]
+        assert exercises[0]['answer'] == 'A "brace" }'
+        assert exercises[1]['type'] == "Exercise 2"
+
+    def test_shared_service_is_created_on_first_use(self, monkeypatch):
+        """Test that the module-level service is built lazily and only once."""
+        import services.gemini_service as module
+        monkeypatch.setattr(module, '_service', None)
+        
+        with patch('google.generativeai.configure'), patch('google.generativeai.GenerativeModel'):
+            service = module.get_gemini_service()
+            
+            assert module.get_gemini_service() is service
+            assert module.gemini_service is service
+
+    @pytest.mark.asyncio
+    async def test_streamed_reply_is_cached(self, gemini_service_instance, monkeypatch):
+        """Test that a completed stream is cached and served whole the next time."""
+        model = Mock()
+        model.generate_content.return_value = iter([Mock(text="Hello "), Mock(text="again")])
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        gemini_service_instance.cache_clear()
+        
+        first = [piece async for piece in gemini_service_instance.summarize_content_stream("Stream me")]
+        second = [piece async for piece in gemini_service_instance.summarize_content_stream("Stream me")]
+        
+        assert first == ["Hello ", "again"]
+        assert second == ["Hello again"]
+        model.generate_content.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_failed_stream_trips_the_breaker_and_frees_its_slot(self, gemini_service_instance, monkeypatch):
+        """Test that an overloaded stream counts towards the breaker and gives its slot back."""
+        model = Mock()
+        model.generate_content.side_effect = Exception("503 The model is overloaded")
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        monkeypatch.setattr(gemini_service_instance, '_breaker', CircuitBreaker(threshold=1, cooldown_seconds=30))
+        monkeypatch.setattr(gemini_service_instance, '_slots', ConcurrencyLimiter(1))
+        gemini_service_instance.cache_clear()
+
+        pieces = [piece async for piece in gemini_service_instance._generate_content_stream("Summarize this")]
+
+        assert pieces == [gemini_service_instance._get_fallback_response("Summarize this")]
+        assert gemini_service_instance._breaker.is_open()
+        await asyncio.wait_for(gemini_service_instance._slots.acquire(), timeout=1)
+
+    @pytest.mark.asyncio
+    async def test_timed_out_call_keeps_its_slot_until_the_worker_finishes(self, gemini_service_instance, monkeypatch):
+        """Test that a call abandoned on timeout holds its slot until the SDK call returns."""
+        import services.gemini_service as module
+        worker_done = threading.Event()
+        model = Mock()
+        model.generate_content.side_effect = lambda *args, **kwargs: worker_done.wait(5)
+        monkeypatch.setattr(gemini_service_instance, 'model', model)
+        monkeypatch.setattr(gemini_service_instance, 'max_retries', 1)
+        monkeypatch.setattr(gemini_service_instance, '_limiter', None)
+        monkeypatch.setattr(gemini_service_instance, '_breaker', None)
+        monkeypatch.setattr(gemini_service_instance, '_slots', ConcurrencyLimiter(1))
+        monkeypatch.setattr(module, 'REQUEST_TIMEOUT_SECONDS', 0.05)
+        
+        try:
+            with pytest.raises(Exception, match="busy"):
+                await gemini_service_instance._generate_content_with_retry("Summarize this")
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(gemini_service_instance._slots.acquire(), timeout=0.05)
+        finally:
+            worker_done.set()
+        await asyncio.wait_for(gemini_service_instance._slots.acquire(), timeout=1)
+
+    def test_prepare_cleans_course_text(self, gemini_service_instance):
+        """Test that invisible characters and trailing spaces are dropped and page breaks become paragraph breaks."""
+        text = "Header  \r\nPage one\u200b text\fHeader\r\nPage two"
+        
+        assert gemini_service_instance._prepare(text) == "Header\nPage one text\n\nHeader\nPage two"
+
+    @pytest.mark.asyncio
+    async def test_identical_concurrent_prompts_share_one_call(self, gemini_service_instance, monkeypatch):
+        """Test that concurrent identical prompts are coalesced into one request."""
+        gemini_service_instance.cache_clear()
+        calls = []
+        
+        async def slow_generate(prompt, generation_config=None):
+            calls.append(prompt)
+            await asyncio.sleep(0.01)
+            return "Shared response"
+        
+        monkeypatch.setattr(gemini_service_instance, '_generate_content_with_retry', slow_generate)
+        
+        results = await asyncio.gather(*[
+            gemini_service_instance._generate_content("Explain this") for _ in range(3)
+        ])
+        
+        assert results == ["Shared response"] * 3
+        assert len(calls) == 1
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
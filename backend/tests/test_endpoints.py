@@ -5,14 +5,23 @@ This script tests all endpoints with real API calls.
 """
 
 import requests
-import json
+import socket
 import time
+import orjson
+from datetime import datetime
+from types import MappingProxyType
 from typing import Dict, Any
+from urllib.parse import urlparse
 
 # Configuration
 BASE_URL = "http://localhost:5000"
 API_BASE = f"{BASE_URL}/api"
 
+# (connect, read) timeouts so a dead server fails fast instead of hanging
+REQUEST_TIMEOUT = (1.0, 30.0)
+# Error responses are produced before any Gemini call, so expect them quickly
+ERROR_TIMEOUT = (1.0, 2.0)
+
 # Test data
 SAMPLE_CONTENT = """
 Machine Learning is a subset of artificial intelligence (AI) that focuses on algorithms 
@@ -27,11 +36,16 @@ Key concepts include:
 4. Deep Learning - Machine learning using deep neural networks
 """
 
-TEST_USER = {
+# Request bodies are encoded once and sent as-is (the session sets the JSON content type)
+SAMPLE_CONTENT_BODY = orjson.dumps({"text": SAMPLE_CONTENT})
+SAMPLE_CONTENT_BODY_WITH_USER = orjson.dumps({"text": SAMPLE_CONTENT, "user_id": 1})
+
+TEST_USER = MappingProxyType({
     "name": "Test Student",
     "email": "test.student@example.com",
     "language_pref": "english"
-}
+})
+TEST_USER_BODY = orjson.dumps(dict(TEST_USER))
 
 class APITester:
     """Class to test all API endpoints."""
@@ -43,19 +57,21 @@ class APITester:
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         })
+        self.session.max_redirects = 0
         self.test_results = []
     
     def log_test(self, name: str, success: bool, response: requests.Response = None, error: str = None):
         """Log test results."""
+        # Raw values only; formatting is deferred to save_results
         result = {
             'test': name,
             'success': success,
-            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+            'timestamp_ns': time.time_ns()
         }
         
         if response:
             result['status_code'] = response.status_code
-            result['response_time'] = f"{response.elapsed.total_seconds():.2f}s"
+            result['elapsed_s'] = response.elapsed.total_seconds()
             
             try:
                 result['response_data'] = response.json()
@@ -71,7 +87,7 @@ class APITester:
         status = "✅ PASS" if success else "❌ FAIL"
         print(f"{status} - {name}")
         if response:
-            print(f"   Status: {response.status_code}, Time: {response.elapsed.total_seconds():.2f}s")
+            print(f"   Status: {response.status_code}, Time: {result['elapsed_s']:.2f}s")
         if error:
             print(f"   Error: {error}")
         print()
@@ -82,7 +98,7 @@ class APITester:
         
         # Test main health endpoint
         try:
-            response = self.session.get(f"{BASE_URL}/health")
+            response = self.session.get(f"{BASE_URL}/health", timeout=REQUEST_TIMEOUT)
             success = response.status_code == 200 and 'status' in response.json()
             self.log_test("Health Check - Main", success, response)
         except Exception as e:
@@ -90,7 +106,7 @@ class APITester:
         
         # Test API health endpoint
         try:
-            response = self.session.get(f"{self.base_url}/health")
+            response = self.session.get(f"{self.base_url}/health", timeout=REQUEST_TIMEOUT)
             success = response.status_code == 200 and 'status' in response.json()
             self.log_test("Health Check - API", success, response)
         except Exception as e:
@@ -102,8 +118,7 @@ class APITester:
         
         # Test valid request
         try:
-            payload = {"text": SAMPLE_CONTENT}
-            response = self.session.post(f"{self.base_url}/summarize", json=payload)
+            response = self.session.post(f"{self.base_url}/summarize", data=SAMPLE_CONTENT_BODY, timeout=REQUEST_TIMEOUT)
             success = response.status_code == 200 and 'summary' in response.json()
             self.log_test("Summarize - Valid Content", success, response)
         except Exception as e:
@@ -111,8 +126,7 @@ class APITester:
         
         # Test with user_id
         try:
-            payload = {"text": SAMPLE_CONTENT, "user_id": 1}
-            response = self.session.post(f"{self.base_url}/summarize", json=payload)
+            response = self.session.post(f"{self.base_url}/summarize", data=SAMPLE_CONTENT_BODY_WITH_USER, timeout=REQUEST_TIMEOUT)
             success = response.status_code == 200 and 'summary' in response.json()
             self.log_test("Summarize - With User ID", success, response)
         except Exception as e:
@@ -121,7 +135,7 @@ class APITester:
         # Test empty text
         try:
             payload = {"text": ""}
-            response = self.session.post(f"{self.base_url}/summarize", json=payload)
+            response = self.session.post(f"{self.base_url}/summarize", json=payload, timeout=ERROR_TIMEOUT)
             success = response.status_code == 400
             self.log_test("Summarize - Empty Text", success, response)
         except Exception as e:
@@ -130,7 +144,7 @@ class APITester:
         # Test missing text field
         try:
             payload = {}
-            response = self.session.post(f"{self.base_url}/summarize", json=payload)
+            response = self.session.post(f"{self.base_url}/summarize", json=payload, timeout=ERROR_TIMEOUT)
             success = response.status_code == 400
             self.log_test("Summarize - Missing Text", success, response)
         except Exception as e:
@@ -142,8 +156,7 @@ class APITester:
         
         # Test valid request
         try:
-            payload = {"text": SAMPLE_CONTENT}
-            response = self.session.post(f"{self.base_url}/explain", json=payload)
+            response = self.session.post(f"{self.base_url}/explain", data=SAMPLE_CONTENT_BODY, timeout=REQUEST_TIMEOUT)
             success = (response.status_code == 200 and 
                       'arabic_explanation' in response.json() and 
                       'english_explanation' in response.json())
@@ -153,8 +166,7 @@ class APITester:
         
         # Test with user_id
         try:
-            payload = {"text": SAMPLE_CONTENT, "user_id": 1}
-            response = self.session.post(f"{self.base_url}/explain", json=payload)
+            response = self.session.post(f"{self.base_url}/explain", data=SAMPLE_CONTENT_BODY_WITH_USER, timeout=REQUEST_TIMEOUT)
             success = (response.status_code == 200 and 
                       'arabic_explanation' in response.json() and 
                       'english_explanation' in response.json())
@@ -165,7 +177,7 @@ class APITester:
         # Test empty text
         try:
             payload = {"text": ""}
-            response = self.session.post(f"{self.base_url}/explain", json=payload)
+            response = self.session.post(f"{self.base_url}/explain", json=payload, timeout=ERROR_TIMEOUT)
             success = response.status_code == 400
             self.log_test("Explain - Empty Text", success, response)
         except Exception as e:
@@ -177,8 +189,7 @@ class APITester:
         
         # Test valid request
         try:
-            payload = {"text": SAMPLE_CONTENT}
-            response = self.session.post(f"{self.base_url}/generate_exercises", json=payload)
+            response = self.session.post(f"{self.base_url}/generate_exercises", data=SAMPLE_CONTENT_BODY, timeout=REQUEST_TIMEOUT)
             success = (response.status_code == 200 and 
                       'exercises' in response.json() and
                       len(response.json()['exercises']) > 0)
@@ -188,8 +199,7 @@ class APITester:
         
         # Test with user_id
         try:
-            payload = {"text": SAMPLE_CONTENT, "user_id": 1}
-            response = self.session.post(f"{self.base_url}/generate_exercises", json=payload)
+            response = self.session.post(f"{self.base_url}/generate_exercises", data=SAMPLE_CONTENT_BODY_WITH_USER, timeout=REQUEST_TIMEOUT)
             success = (response.status_code == 200 and 
                       'exercises' in response.json())
             self.log_test("Generate Exercises - With User ID", success, response)
@@ -199,7 +209,7 @@ class APITester:
         # Test empty text
         try:
             payload = {"text": ""}
-            response = self.session.post(f"{self.base_url}/generate_exercises", json=payload)
+            response = self.session.post(f"{self.base_url}/generate_exercises", json=payload, timeout=ERROR_TIMEOUT)
             success = response.status_code == 400
             self.log_test("Generate Exercises - Empty Text", success, response)
         except Exception as e:
@@ -211,7 +221,7 @@ class APITester:
         
         # Test create user
         try:
-            response = self.session.post(f"{self.base_url}/users", json=TEST_USER)
+            response = self.session.post(f"{self.base_url}/users", data=TEST_USER_BODY, timeout=REQUEST_TIMEOUT)
             success = response.status_code in [201, 409]  # 201 for new user, 409 if exists
             self.log_test("Create User", success, response)
             
@@ -224,7 +234,7 @@ class APITester:
         # Test get user sessions
         try:
             email = TEST_USER['email']
-            response = self.session.get(f"{self.base_url}/users/{email}/sessions")
+            response = self.session.get(f"{self.base_url}/users/{email}/sessions", timeout=REQUEST_TIMEOUT)
             success = response.status_code in [200, 404]  # 200 if user exists, 404 if not
             self.log_test("Get User Sessions", success, response)
             
@@ -237,7 +247,7 @@ class APITester:
         # Test create user with missing fields
         try:
             payload = {"name": "Incomplete User"}  # Missing email
-            response = self.session.post(f"{self.base_url}/users", json=payload)
+            response = self.session.post(f"{self.base_url}/users", json=payload, timeout=ERROR_TIMEOUT)
             success = response.status_code == 400
             self.log_test("Create User - Missing Fields", success, response)
         except Exception as e:
@@ -249,7 +259,7 @@ class APITester:
         
         # Test 404 endpoint
         try:
-            response = self.session.get(f"{self.base_url}/nonexistent")
+            response = self.session.get(f"{self.base_url}/nonexistent", timeout=ERROR_TIMEOUT)
             success = response.status_code == 404
             self.log_test("404 Error Handling", success, response)
         except Exception as e:
@@ -257,7 +267,7 @@ class APITester:
         
         # Test method not allowed
         try:
-            response = self.session.get(f"{self.base_url}/summarize")  # Should be POST
+            response = self.session.get(f"{self.base_url}/summarize", timeout=ERROR_TIMEOUT)  # Should be POST
             success = response.status_code == 405
             self.log_test("405 Method Not Allowed", success, response)
         except Exception as e:
@@ -267,7 +277,8 @@ class APITester:
         try:
             response = requests.post(f"{self.base_url}/summarize", 
                                    data="invalid json",
-                                   headers={'Content-Type': 'application/json'})
+                                   headers={'Content-Type': 'application/json'},
+                                   timeout=ERROR_TIMEOUT)
             success = response.status_code == 400
             self.log_test("Invalid JSON Handling", success, response)
         except Exception as e:
@@ -316,8 +327,14 @@ class APITester:
     
     def save_results(self, filename: str = "test_results.json"):
         """Save test results to file."""
-        with open(filename, 'w') as f:
-            json.dump(self.test_results, f, indent=2)
+        for result in self.test_results:
+            if 'timestamp_ns' in result:
+                result['timestamp'] = datetime.fromtimestamp(result.pop('timestamp_ns') / 1e9).isoformat()
+            if 'elapsed_s' in result:
+                result['response_time'] = f"{result.pop('elapsed_s'):.2f}s"
+        
+        with open(filename, 'wb') as f:
+            f.write(orjson.dumps(self.test_results, option=orjson.OPT_INDENT_2))
         print(f"\n💾 Test results saved to {filename}")
 
 def main():
@@ -326,6 +343,15 @@ def main():
     print("Make sure your Flask application is running on http://localhost:5000")
     print()
     
+    # Cheap TCP probe first; only pay for an HTTP round-trip once the port is open
+    server = urlparse(BASE_URL)
+    try:
+        with socket.create_connection((server.hostname, server.port), timeout=0.5):
+            pass
+    except OSError:
+        print("❌ Cannot connect to server. Please start the Flask app on localhost:5000")
+        return False
+    
     # Check if server is running
     try:
         response = requests.get(f"{BASE_URL}/health", timeout=5)
@@ -10,7 +10,7 @@ echo 🚀 Setting up AI Bootcamp Tutor MVP...
 REM Check Python version
 python --version
 if %errorlevel% neq 0 (
-    echo ❌ Python not found. Please install Python 3.10+ first.
+    echo ❌ Python not found. Please install Python 3.11+ first.
     pause
     exit /b 1
 )